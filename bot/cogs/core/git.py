@@ -113,6 +113,12 @@ class Git(commands.Cog):
         ))
 
         self.bot.log.info('Restarting')
+
+        # Hand running player sessions over to the next process, which continues them from where they stopped
+        player = self.bot.get_cog('Player')
+        if player is not None:
+            await player.handoff()
+
         await self.bot.logout()
 
 
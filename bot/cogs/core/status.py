@@ -77,27 +77,33 @@ class Status(commands.Cog):
         process = psutil.Process(os.getpid())
         memory_usage = process.memory_info().rss / 1024 ** 2
 
-        await ctx.send(
-            embed=discord.Embed(
-                title=f'{self.bot.user.name} v{self.bot.__version__} Status',
-                colour=self.bot.user.colour
-            ).set_thumbnail(
-                url=self.bot.user.avatar_url
-            ).add_field(
-                name='Users:', value=len(self.bot.users)
-            ).add_field(
-                name='Guilds:', value=len(self.bot.guilds)
-            ).add_field(
-                name='Started at:', value=tools.format_dt(self.bot._start_time)
-            ).add_field(
-                name='Memory usage:', value=f'{memory_usage:.2f} MB'
-            ).add_field(
-                name='Cogs loaded:', value=len(self.bot.cogs)
-            ).add_field(
-                name='Lines of code:', value=lines_of_code or 'Unknown'
-            )
+        embed = discord.Embed(
+            title=f'{self.bot.user.name} v{self.bot.__version__} Status',
+            colour=self.bot.user.colour
+        ).set_thumbnail(
+            url=self.bot.user.avatar_url
+        ).add_field(
+            name='Users:', value=len(self.bot.users)
+        ).add_field(
+            name='Guilds:', value=len(self.bot.guilds)
+        ).add_field(
+            name='Started at:', value=tools.format_dt(self.bot._start_time)
+        ).add_field(
+            name='Memory usage:', value=f'{memory_usage:.2f} MB'
+        ).add_field(
+            name='Cogs loaded:', value=len(self.bot.cogs)
+        ).add_field(
+            name='Lines of code:', value=lines_of_code or 'Unknown'
         )
 
+        if hasattr(self.bot, '_track_resolver'):
+            resolver = self.bot._track_resolver
+            embed.add_field(
+                name='Track cache:', value=f'{len(resolver)} entries, {resolver.hits} hits, {resolver.misses} misses ({resolver.hit_rate:.0%})'
+            )
+
+        await ctx.send(embed=embed)
+
 
 def setup(bot: commands.Bot):
     if not hasattr(bot, '_player_sessions'):
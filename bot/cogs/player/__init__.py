@@ -1,6 +1,15 @@
 import asyncio
 import datetime
+import math
 import random
+import secrets
+import time
+
+from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Set
 
 import discord
 from discord.ext import commands, menus, tasks
@@ -10,10 +19,15 @@ import wavelink
 from bot.config import config as BOT_CONFIG
 
 from bot.utils import checks, tools
-from bot.utils.paginator import EmbedPaginator
 
+from .handoff import ResumableNode, initiate_node
+from .library import Library, LibraryWatcher
+from .nodes import best_node
+from .resolver import TrackResolver
 from .session import Session
-from .track import MP3Track, YouTubeTrack, SoundCloudTrack, AttachmentTrack
+from .snapshot import load_snapshot, save_snapshot
+from .trace import TraceRecorder
+from .track import MP3Track, YouTubeTrack, SoundCloudTrack, AttachmentTrack, Playlist
 
 COG_CONFIG = BOT_CONFIG.EXTENSIONS[__name__]
 
@@ -70,21 +84,91 @@ async def user_has_requests_remaining(ctx: commands.Context) -> bool:
     session = ctx.cog._get_session(ctx.guild)
     if session is not None:
         max_requests = COG_CONFIG.MAX_CONCURRENT_REQUESTS.get(ctx.guild.id) or float('inf')
-        if len([r for r in session.queue.requests if r.requester == ctx.author]) >= max_requests:
+        if session.queue.requests.requested_by(ctx.author) >= max_requests:
             raise commands.UserInputError('You already have too many requests in the queue.')
     return True
 
 
+class QueuePageSource(menus.PageSource):
+    """Pages through a session's request queue, only the page being displayed is looked up.
+
+    Args:
+        session (Session): The session whose queue to display.
+
+    """
+    per_page = 10
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def is_paginating(self) -> bool:
+        return len(self.session.queue.requests) > self.per_page
+
+    def get_max_pages(self) -> int:
+        return max(math.ceil(len(self.session.queue.requests) / self.per_page), 1)
+
+    async def get_page(self, page_number: int):
+        return page_number
+
+    async def format_page(self, menu, page_number: int) -> discord.Embed:
+        requests = self.session.queue.requests
+        length = self.session.time_until(len(requests))
+
+        embed = discord.Embed(
+            colour=discord.Colour.dark_green(),
+            title=f'Upcoming requests - Total Queue Length: {datetime.timedelta(seconds=length)}'
+        )
+
+        start = page_number * self.per_page
+        wait = self.session.time_until(start)
+        for index, track in enumerate(requests.islice(start, start + self.per_page), start + 1):
+            embed.add_field(
+                name=f'{index} - Requested by {track.requester} - Plays in {datetime.timedelta(seconds=wait)}',
+                value=track.information,
+                inline=False
+            )
+            wait += track.length
+
+        if self.is_paginating():
+            embed.set_footer(text=f'Page {page_number + 1}/{self.get_max_pages()}')
+
+        return embed
+
+
 class Player(commands.Cog, wavelink.WavelinkMixin):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self._alone = asyncio.Event()
+        self._watchers: Dict[Path, LibraryWatcher] = dict()
+        self._resume_keys: Optional[Dict[str, str]] = None
         self._restart.start()
+        self._save_state.start()
+        self._check_nodes.start()
+
+        # Record events for offline replay if enabled
+        self._recorder: Optional[TraceRecorder] = None
+        if COG_CONFIG.TRACE_DIRECTORY is not None:
+            self._recorder = TraceRecorder(self.bot, COG_CONFIG.TRACE_DIRECTORY)
+            self.bot.add_listener(self._record_socket_response, 'on_socket_response')
+            self._flush_trace.start()
 
         self.bot.loop.create_task(self.start_nodes())
 
     def cog_unload(self):
         self._restart.cancel()
+        self._save_state.cancel()
+        self._check_nodes.cancel()
+        self.bot.loop.create_task(self.save_state(resume_keys=self._resume_keys))
+        if self._recorder is not None:
+            self.bot.remove_listener(self._record_socket_response, 'on_socket_response')
+            self._flush_trace.cancel()
+            self.bot.loop.create_task(self._recorder.flush())
+
+        for watcher in self._watchers.values():
+            watcher.stop()
+
+        if MP3Track._search_worker is not None:
+            MP3Track._search_worker.stop()
 
     def _get_session(self, guild: discord.Guild) -> Session:
         return self.bot._player_sessions.get(guild)
@@ -102,18 +186,17 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
     async def stop(self, ctx):
         """Stops the currently running player session."""
         session = self._get_session(ctx.guild)
-        listeners = list(session.listeners)
 
-        if len(listeners) == 0:
+        if not session.listeners:
             await session.stop()
 
-        if ctx.author in session.stop_requests:
+        if ctx.author.id in session.stop_requests:
             raise commands.BadArgument('You have already requested to stop the player.')
 
-        if ctx.author.id in listeners:
-            session.stop_requests.append(ctx.author)
+        if ctx.author.id in session.listeners:
+            session.stop_requests.add(ctx.author.id)
 
-        stops_needed = len(listeners)
+        stops_needed = len(session.listeners)
         if len(session.stop_requests) >= stops_needed:
             await session.stop()
         else:
@@ -141,14 +224,19 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
 
         session = self._get_session(ctx.guild)
 
+        message = request.request_message
+
         # If there is no player session start one
         if session is None:
             session = self.bot._player_sessions[ctx.guild] = Session(self.bot, ctx.author.voice.channel, request=request)
         else:
             await user_is_listening(ctx)
-            session.queue.add_request(request)
+            if session.queue.requests.contains(request):
+                raise commands.BadArgument('That track is already in the queue.')
+            index = session.queue.add_request(request)
+            message['embed'].set_footer(text=f'Number {index + 1} in the queue, plays in about {datetime.timedelta(seconds=session.time_until(index))}')
 
-        await ctx.send(**request.request_message)
+        await ctx.send(**message)
 
     @request.command(name='mp3', aliases=['local'])
     @commands.check(user_is_in_voice_channel)
@@ -186,6 +274,85 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
         if (await self.request.can_run(ctx)):
             await ctx.invoke(self.request, request=request)
 
+    @request.command(name='playlist', aliases=['pl'])
+    @commands.check(user_is_in_voice_channel)
+    @commands.check(user_has_required_permissions)
+    @commands.check(user_has_requests_remaining)
+    async def request_playlist(self, ctx, *, playlist: Playlist):
+        """Adds a YouTube or SoundCloud playlist to the requests queue.
+
+        The first track is queued straight away, the rest of the playlist is added in the background.
+
+        playlist: Playlist URL.
+        """
+        if (await self.request.can_run(ctx)):
+            session = self._get_session(ctx.guild)
+            if session is None or not session.queue.requests.contains(playlist.first):
+                await ctx.invoke(self.request, request=playlist.first)
+            self.bot.loop.create_task(self._add_playlist(ctx, playlist))
+
+    async def _add_playlist(self, ctx: commands.Context, playlist: Playlist):
+        session = self._get_session(ctx.guild)
+        if session is None:
+            return
+
+        try:
+            await playlist.load(self.bot)
+        except commands.BadArgument as e:
+            return await ctx.send(embed=discord.Embed(
+                title=f'Error with command: {ctx.command.name}',
+                description=str(e)
+            ))
+
+        # Respect the requester's remaining requests
+        max_requests = COG_CONFIG.MAX_CONCURRENT_REQUESTS.get(ctx.guild.id) or float('inf')
+        remaining = max(max_requests - session.queue.requests.requested_by(ctx.author), 0)
+        tracks = playlist.remaining[:int(min(remaining, COG_CONFIG.MAX_PLAYLIST_LENGTH))]
+
+        if not tracks:
+            return
+
+        message = await ctx.send(embed=discord.Embed(
+            colour=playlist.first._embed_colour,
+            description=f'Adding **{len(tracks)}** tracks from **{playlist.name}** to the queue...'
+        ))
+
+        added = 0
+        batch_size = 25
+        for index in range(0, len(tracks), batch_size):
+
+            # Stop if the session ended while the playlist was being added
+            if self._get_session(ctx.guild) is not session:
+                return
+
+            # Requests made while the playlist is being added count towards the requester's limit
+            limit_reached = False
+            for track in tracks[index:index + batch_size]:
+                if session.queue.requests.requested_by(ctx.author) >= max_requests:
+                    limit_reached = True
+                    break
+
+                # Tracks already in the queue are skipped
+                if not session.queue.requests.contains(track):
+                    session.queue.add_request(track)
+                    added += 1
+
+            if limit_reached:
+                with suppress(discord.HTTPException):
+                    await message.edit(embed=discord.Embed(
+                        colour=playlist.first._embed_colour,
+                        description=f'Added **{added}** tracks from **{playlist.name}** to the queue, you have no requests remaining.'
+                    ))
+                return
+
+            with suppress(discord.HTTPException):
+                await message.edit(embed=discord.Embed(
+                    colour=playlist.first._embed_colour,
+                    description=f'Added **{min(index + batch_size, len(tracks))}/{len(tracks)}** tracks from **{playlist.name}** to the queue...'
+                ))
+
+            await asyncio.sleep(0)
+
     @request.command(name='file')
     @commands.check(user_is_in_voice_channel)
     @commands.check(user_has_required_permissions)
@@ -211,12 +378,12 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
         """Skips the currently playing track."""
         session = self._get_session(ctx.guild)
 
-        if ctx.author in session.skip_requests:
+        if ctx.author.id in session.skip_requests:
             raise commands.BadArgument('You have already requested to skip.')
 
-        session.skip_requests.append(ctx.author)
+        session.skip_requests.add(ctx.author.id)
 
-        skips_needed = len(list(session.listeners)) // 2 + 1
+        skips_needed = len(session.listeners) // 2 + 1
         if len(session.skip_requests) >= skips_needed:
             await session.skip()
         else:
@@ -233,12 +400,12 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
         """Repeats the currently playing track."""
         session = self._get_session(ctx.guild)
 
-        if ctx.author in session.repeat_requests:
+        if ctx.author.id in session.repeat_requests:
             raise commands.BadArgument('You have already requested to repeat.')
 
-        session.repeat_requests.append(ctx.author)
+        session.repeat_requests.add(ctx.author.id)
 
-        repeats_needed = len(list(session.listeners)) // 2 + 1
+        repeats_needed = len(session.listeners) // 2 + 1
         if len(session.repeat_requests) >= repeats_needed:
             session.queue.add_request(session.current_track, at_start=True)
 
@@ -319,34 +486,38 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
 
         session = self._get_session(ctx.guild)
 
-        total_length = session.current_track.length - session.current_track_play_time
-        total_length += sum(track.length for track in session.queue.requests)
-        length_str = str(datetime.timedelta(seconds=total_length))
-
-        paginator = EmbedPaginator(
-            colour=discord.Colour.dark_green(),
-            title=f'Upcoming requests - Total Queue Length: {length_str}',
-            max_fields=10
-        )
-
         if not session.queue.requests:
             raise commands.UserInputError('There are currently no requests.')
 
-        for index, track in enumerate(session.queue.requests, 1):
-            paginator.add_field(
-                name=f'{index} - Requested by {track.requester}',
-                value=track.information,
-                inline=False
-            )
+        source = QueuePageSource(session)
 
         try:
-            if len(paginator.pages) == 1:
-                return await ctx.send(embed=paginator.pages[0])
-            menu = menus.MenuPages(paginator, clear_reactions_after=True, check_embeds=True)
+            if not source.is_paginating():
+                return await ctx.send(embed=await source.format_page(None, 0))
+            menu = menus.MenuPages(source, clear_reactions_after=True, check_embeds=True)
             await menu.start(ctx)
         except discord.HTTPException:
             raise commands.BadArgument('I couldn\'t post the queue in this channel.')
 
+    @commands.command(name='position', aliases=['eta', 'when'])
+    @commands.check(session_is_running)
+    async def position(self, ctx):
+        """Displays when your next request will play."""
+        session = self._get_session(ctx.guild)
+
+        index = session.queue.next_request_by(ctx.author)
+        if index is None:
+            raise commands.UserInputError('You do not have any requests in the queue.')
+
+        wait = session.time_until(index)
+
+        await ctx.send(embed=discord.Embed(
+            colour=discord.Colour.dark_green(),
+            title='Your next request',
+            description=f'{session.queue.requests[index].information} is number **{index + 1}** in the queue '
+                        f'and will play in about **{datetime.timedelta(seconds=wait)}**.'
+        ))
+
     @tools.auto_help
     @commands.group(name='force')
     @commands.check_any(commands.check(checks.is_administrator), commands.check(checks.is_owner))
@@ -380,19 +551,15 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
     async def force_remove(self, ctx, track_number: int):
         """Force remove a track from the queue"""
         session = self._get_session(ctx.guild)
-        if track_number < 0 or track_number > len(session.queue.requests):
+        if track_number < 1 or track_number > len(session.queue.requests):
             raise commands.BadArgument('Track not in queue.')
-        session.queue.requests.pop(track_number - 1)
+        session.queue.remove_request(track_number - 1)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
         session = self._get_session(member.guild)
         if session is not None:
-            if member.id not in session.listeners:
-                for request_list in [session.skip_requests, session.repeat_requests, session.stop_requests]:
-                    if member in request_list:
-                        request_list.remove(member)
-
+            session.update_listener(member, after)
             await session.check_listeners()
 
             # Set alone flag for auto restart
@@ -401,6 +568,10 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
             else:
                 self._alone.clear()
 
+    async def _record_socket_response(self, message: Dict):
+        # Only registered while recording a trace, see __init__
+        self._recorder.gateway(message)
+
     @wavelink.WavelinkMixin.listener()
     async def on_track_end(self, node, payload):
         session = self._get_session(self.bot.get_guild(int(payload.player.guild_id)))
@@ -426,36 +597,202 @@ class Player(commands.Cog, wavelink.WavelinkMixin):
 
         await self.bot.wait_until_ready()
 
-        await self.bot._wavelink.initiate_node(
+        await self.bot._track_resolver.load(COG_CONFIG.RESOLVE_CACHE_FILE)
+
+        snapshot = await load_snapshot(COG_CONFIG.SESSION_SNAPSHOT_FILE, max_age=COG_CONFIG.SESSION_SNAPSHOT_MAX_AGE)
+
+        # Lavalink sessions handed over by the previous process are only kept for a limited time
+        resume_keys = snapshot['resume_keys']
+        if snapshot['saved_at'] + COG_CONFIG.HANDOFF_TIMEOUT < time.time():
+            resume_keys = dict()
+
+        resumed = set()
+        for node in self._lavalink_nodes():
+            try:
+                lavalink_node = await initiate_node(
+                    self.bot._wavelink, rest_uri=f'http://{node["host"]}:{node["port"]}', resume_key=resume_keys.get(node['identifier']), **node
+                )
+            except Exception as e:
+                self.bot.log.error(f'Failed to connect to Lavalink node {node["identifier"]}: {type(e).__name__}: {e}')
+            else:
+                if self._recorder is not None:
+                    lavalink_node.subscribe(self._recorder.lavalink)
+                if node['identifier'] in resume_keys:
+                    resumed.add(node['identifier'])
+
+        snapshots = {session['guild']: session for session in snapshot['sessions']}
+
+        for instance in COG_CONFIG.INSTANCES:
+            if self.bot.get_channel(instance.voice_channel.id) is None:
+                continue
+
+            session = snapshots.pop(instance.voice_channel.guild.id, None)
+            self.bot._player_sessions[instance.voice_channel.guild] = Session(
+                self.bot, run_forever=True, stoppable=False, snapshot=session,
+                resumed=session is not None and session.get('node') in resumed, **instance.__dict__
+            )
+
+        self._restore_sessions(snapshots.values(), resumed)
+
+        await self.setup_libraries()
+
+    def _restore_sessions(self, snapshots: List[Dict], resumed: Set[str]):
+        """Restarts the sessions which were running when the snapshots were made.
+
+        Args:
+            snapshots (list of dict): The snapshots of the sessions to restart.
+            resumed (set of str): The identifiers of the nodes whose Lavalink sessions were resumed.
+
+        """
+        for snapshot in snapshots:
+            voice_channel = self.bot.get_channel(snapshot['voice_channel'])
+            if voice_channel is None or voice_channel.guild in self.bot._player_sessions:
+                continue
+
+            log_channel = None
+            if snapshot.get('log_channel') is not None:
+                log_channel = self.bot.get_channel(snapshot['log_channel'])
+
+            self.bot.log.info(f'Restoring player session in {voice_channel.guild}.')
+            self.bot._player_sessions[voice_channel.guild] = Session(
+                self.bot, voice_channel, log_channel=log_channel, run_forever=snapshot.get('run_forever', False),
+                stoppable=snapshot.get('stoppable', True), snapshot=snapshot, resumed=snapshot.get('node') in resumed
+            )
+
+    async def save_state(self, *, resume_keys: Dict[str, str] = None):
+        """Saves the track cache and a snapshot of every running session so they can be restored after a restart.
+
+        Kwargs:
+            resume_keys (dict): The resume keys of Lavalink sessions handed to the next process, by node identifier.
+
+        """
+        await self.bot._track_resolver.save(COG_CONFIG.RESOLVE_CACHE_FILE)
+
+        snapshots = [session.snapshot() for session in self.bot._player_sessions.values()]
+        await save_snapshot(COG_CONFIG.SESSION_SNAPSHOT_FILE, [snapshot for snapshot in snapshots if snapshot is not None], resume_keys=resume_keys)
+
+    async def handoff(self):
+        """Prepares for a restart which resumes playback where it stopped.
+
+        Lavalink is asked to keep every node's session and its players after this process disconnects,
+        the next process resumes the sessions and takes over their players.
+        Logging out ends the bot's Discord session, which disconnects it from voice,
+        so audio stops for the length of the restart and each track continues from where it stopped once the next process rejoins.
+        """
+        # The periodic snapshot must not overwrite the one holding the resume keys
+        self._save_state.cancel()
+
+        resume_keys = dict()
+        for node in self.bot._wavelink.nodes.values():
+            if not isinstance(node, ResumableNode) or not node.is_available:
+                continue
+
+            key = secrets.token_urlsafe(16)
+            try:
+                await node.configure_resuming(key, COG_CONFIG.HANDOFF_TIMEOUT)
+            except Exception as e:
+                self.bot.log.error(f'Failed to configure resuming on Lavalink node {node.identifier}: {type(e).__name__}: {e}')
+            else:
+                resume_keys[node.identifier] = key
+
+        # Kept so the snapshot saved when the cog is unloaded still hands the sessions over
+        self._resume_keys = resume_keys
+        await self.save_state(resume_keys=resume_keys)
+
+    @staticmethod
+    def _lavalink_nodes() -> List[Dict]:
+        nodes = getattr(COG_CONFIG, 'LAVALINK_NODES', None)
+        if nodes:
+            return [dict(node.__dict__) for node in nodes]
+
+        return [dict(
             host=COG_CONFIG.LAVALINK_ADDRESS,
             port=2333,
-            rest_uri=f'http://{COG_CONFIG.LAVALINK_ADDRESS}:2333',
             password=COG_CONFIG.LAVALINK_PASSWORD,
             identifier=BOT_CONFIG.APP_NAME,
             region='us_east'
-        )
+        )]
 
-        for instance in COG_CONFIG.INSTANCES:
-            if self.bot.get_channel(instance.voice_channel.id) is None:
+    @tasks.loop(seconds=10)
+    async def _check_nodes(self):
+        for session in list(self.bot._player_sessions.values()):
+            old_node = session.player.node
+            if old_node is None or old_node.is_available:
+                continue
+
+            node = best_node(self.bot._wavelink, exclude=old_node)
+            if node is None:
                 continue
 
-            self.bot._player_sessions[instance.voice_channel.guild] = Session(self.bot, run_forever=True, stoppable=False, **instance.__dict__)
+            self.bot.log.warning(f'Lavalink node {old_node.identifier} is unavailable, moving {session.guild} to {node.identifier}.')
+            try:
+                await session.player.change_node(node.identifier)
+            except Exception as e:
+                self.bot.log.error(f'Failed to move {session.guild} to {node.identifier}: {type(e).__name__}: {e}')
+
+    @_check_nodes.before_loop
+    async def _before_check_nodes(self):
+        await self.bot.wait_until_ready()
+
+    def _scan_progress(self, library: Library, done: int, total: int):
+        if done == total:
+            self.bot.log.info(f'Finished scanning {library.directory}, read {total} new or changed files.')
+        else:
+            self.bot.log.debug(f'Scanning {library.directory}: {done}/{total} files read.')
+
+    async def setup_libraries(self):
+        """Loads and starts watching every MP3 library in use.
 
-        if not MP3Track._search_ready.is_set():
-            self.bot.loop.run_in_executor(None, MP3Track.setup_search)
+        Files are read by a process pool, libraries are usable while they are being scanned.
+        """
+        executor = ProcessPoolExecutor(COG_CONFIG.LIBRARY_SCAN_WORKERS)
+        try:
+            if not MP3Track._search_ready.is_set():
+                await MP3Track.setup_search(executor, partial(self._scan_progress, MP3Track._library))
+
+            for library in Library.all():
+                if library.directory in self._watchers:
+                    continue
+
+                if not library.loaded:
+                    await library.scan(COG_CONFIG.LIBRARY_CACHE, executor=executor, progress=partial(self._scan_progress, library))
+
+                watcher = self._watchers[library.directory] = LibraryWatcher(library, interval=COG_CONFIG.LIBRARY_POLL_INTERVAL)
+                watcher.start()
+        finally:
+            # Waiting for the workers to exit would block the event loop
+            executor.shutdown(wait=False)
 
     @tasks.loop(hours=12)
     async def _restart(self):
         if self._restart.current_loop != 0:
             await self._alone.wait()
             self.bot.log.info('Automatically Restarting')
+            await self.handoff()
             await self.bot.logout()
 
+    @tasks.loop(seconds=10)
+    async def _flush_trace(self):
+        await self._recorder.flush()
+
+    @tasks.loop(minutes=1)
+    async def _save_state(self):
+        if self._save_state.current_loop != 0:
+            await self.save_state()
+
 
 def setup(bot: commands.Bot):
     if not hasattr(bot, '_wavelink'):
         bot._wavelink = wavelink.Client(bot=bot)
 
+    if not hasattr(bot, '_track_resolver'):
+        bot._track_resolver = TrackResolver(
+            bot._wavelink,
+            max_size=COG_CONFIG.RESOLVE_CACHE_SIZE,
+            search_ttl=COG_CONFIG.RESOLVE_CACHE_SEARCH_TTL,
+            track_ttl=COG_CONFIG.RESOLVE_CACHE_TRACK_TTL
+        )
+
     if not hasattr(bot, '_player_sessions'):
         bot._player_sessions = dict()
 
@@ -0,0 +1,102 @@
+from typing import Callable, Dict, List
+
+import wavelink
+
+
+class ResumingWebSocket(wavelink.WebSocket):
+    """A Lavalink websocket which resumes a previous session when it has a resume key."""
+
+    def __init__(self, *, resume_key: str = None, **attrs):
+        super().__init__(**attrs)
+        self.resume_key = resume_key
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = super().headers
+        if self.resume_key is not None:
+            headers['Resume-Key'] = self.resume_key
+        return headers
+
+    async def process_data(self, data: Dict):
+        for callback in self._node._subscribers:
+            callback(data)
+        await super().process_data(data)
+
+
+class ResumableNode(wavelink.Node):
+    """A Lavalink node whose session can be handed to another process.
+
+    Once `configure_resuming` has been called Lavalink keeps the node's players playing after the websocket closes,
+    a node connecting with the same resume key takes over the session and its players.
+
+    Kwargs:
+        resume_key (str): The resume key of a previous session to take over when connecting.
+
+    """
+
+    def __init__(self, *args, resume_key: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resume_key = resume_key
+        self._subscribers: List[Callable[[Dict], None]] = list()
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """Registers a callback to be called with every message received from Lavalink."""
+        self._subscribers.append(callback)
+
+    async def connect(self, bot):
+        self._websocket = ResumingWebSocket(
+            node=self,
+            host=self.host,
+            port=self.port,
+            password=self.password,
+            shard_count=self.shards,
+            user_id=self.uid,
+            secure=self.secure,
+            dumps=self._dumps,
+            resume_key=self.resume_key
+        )
+        await self._websocket._connect()
+
+    async def configure_resuming(self, key: str, timeout: int):
+        """Asks Lavalink to keep this node's session running after it disconnects.
+
+        Args:
+            key (str): The key another connection can resume the session with.
+            timeout (int): How long in seconds the session is kept waiting to be resumed.
+
+        """
+        self.resume_key = self._websocket.resume_key = key
+        await self._send(op='configureResuming', key=key, timeout=timeout)
+
+
+async def initiate_node(client: wavelink.Client, host: str, port: int, *, rest_uri: str, password: str, region: str, identifier: str,
+                        resume_key: str = None, **kwargs) -> ResumableNode:
+    """Connects a resumable Lavalink node, see `wavelink.Client.initiate_node`.
+
+    Kwargs:
+        resume_key (str): The resume key of a previous session to take over.
+
+    """
+    await client.bot.wait_until_ready()
+
+    if identifier in client.nodes:
+        raise wavelink.NodeOccupied(f'Node with identifier ({identifier}) already exists.')
+
+    node = ResumableNode(
+        host, port, client.shard_count, client.user_id,
+        rest_uri=rest_uri,
+        password=password,
+        region=region,
+        identifier=identifier,
+        session=client.session,
+        client=client,
+        dumps=client._dumps,
+        resume_key=resume_key,
+        **kwargs
+    )
+
+    await node.connect(client.bot)
+
+    node.available = True
+    client.nodes[identifier] = node
+    return node
@@ -0,0 +1,170 @@
+import os
+import re
+import struct
+
+from pathlib import Path
+from typing import BinaryIO, Dict, NamedTuple, Optional
+
+TEXT_FRAMES = {
+    b'TIT2': 'title',
+    b'TPE1': 'artist',
+    b'TALB': 'album',
+    b'TDRC': 'date',
+    b'TYER': 'date',
+}
+
+ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+# The most of an APIC frame read to find where its image starts
+MAX_PICTURE_HEADER = 1024
+
+_HEADER = struct.Struct('>3sBBB4s')
+_FRAME_HEADER = struct.Struct('>4s4sH')
+_FRAME_ID = re.compile(rb'[A-Z0-9]{4}')
+
+
+class ID3Error(ValueError):
+    """The file has no ID3v2 tag this reader can handle."""
+
+
+class ID3Tags(NamedTuple):
+    """The parts of an ID3v2 tag used by the player."""
+    text: Dict[str, str]
+    tag_size: int
+    cover_offset: Optional[int] = None
+    cover_length: Optional[int] = None
+
+
+def _read(f: BinaryIO, size: int) -> bytes:
+    """Reads exactly `size` bytes, a file ending early is treated as a damaged tag."""
+    data = f.read(size)
+    if len(data) < size:
+        raise ID3Error('Unexpected end of file.')
+    return data
+
+
+def _synchsafe(data: bytes) -> int:
+    if any(byte & 0x80 for byte in data):
+        raise ID3Error('Invalid synchsafe integer.')
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def _decode_text(data: bytes) -> str:
+    if not data:
+        raise ID3Error('Empty text frame.')
+    try:
+        text = data[1:].decode(ENCODINGS[data[0]])
+    except (IndexError, UnicodeDecodeError):
+        raise ID3Error('Invalid text encoding.')
+    return text.split('\0')[0]
+
+
+def _picture_offset(data: bytes) -> int:
+    """Finds where the image starts within the body of an APIC frame."""
+    if not data or data[0] >= len(ENCODINGS):
+        raise ID3Error('Invalid text encoding.')
+
+    mime_end = data.find(b'\0', 1)
+    if mime_end == -1:
+        raise ID3Error('Unterminated picture MIME type.')
+
+    # Skip the picture type, then the encoded description
+    start = mime_end + 2
+    if data[0] in (1, 2):
+        end = start
+        while True:
+            end = data.find(b'\0\0', end)
+            if end == -1:
+                raise ID3Error('Unterminated picture description.')
+            if (end - start) % 2 == 0:
+                return end + 2
+            end += 1
+
+    end = data.find(b'\0', start)
+    if end == -1:
+        raise ID3Error('Unterminated picture description.')
+    return end + 1
+
+
+def _read_frames(f: BinaryIO, version: int, end: int) -> ID3Tags:
+    text: Dict[str, str] = dict()
+    cover_offset = cover_length = None
+
+    while f.tell() + _FRAME_HEADER.size <= end:
+        frame_id, size, flags = _FRAME_HEADER.unpack(_read(f, _FRAME_HEADER.size))
+
+        # Padding
+        if frame_id[0] == 0:
+            break
+
+        if _FRAME_ID.fullmatch(frame_id) is None:
+            raise ID3Error(f'Invalid frame {frame_id!r}.')
+
+        size = _synchsafe(size) if version == 4 else int.from_bytes(size, 'big')
+        start = f.tell()
+        if start + size > end:
+            raise ID3Error(f'Frame {frame_id!r} exceeds the tag.')
+
+        wanted = frame_id in TEXT_FRAMES or frame_id == b'APIC' and cover_offset is None
+        if wanted:
+            # Compressed, encrypted, grouped or unsynchronised frames are left to mutagen
+            if flags & (0x004E if version == 4 else 0x00E0):
+                raise ID3Error(f'Unsupported flags on frame {frame_id!r}.')
+
+            # Skip the data length indicator
+            if version == 4 and flags & 0x0001:
+                if size < 4:
+                    raise ID3Error(f'Frame {frame_id!r} is too short.')
+                f.seek(4, 1)
+                start, size = start + 4, size - 4
+
+            if frame_id == b'APIC':
+                offset = _picture_offset(_read(f, min(size, MAX_PICTURE_HEADER)))
+                cover_offset, cover_length = start + offset, size - offset
+
+            # TDRC takes precedence over the ID3v2.3 TYER frame
+            elif frame_id != b'TYER' or 'date' not in text:
+                text[TEXT_FRAMES[frame_id]] = _decode_text(_read(f, size))
+
+        f.seek(start + size)
+
+    return ID3Tags(text, end, cover_offset, cover_length)
+
+
+def read_tags(path: Path) -> ID3Tags:
+    """Reads the title, artist, album and date frames of an ID3v2.3 or ID3v2.4 tag.
+
+    Only the tag's header and the wanted frames are read,
+    the position of the first attached picture is recorded without reading the image.
+
+    Raises:
+        ID3Error: The file has no ID3v2 tag, its tag is damaged or truncated, or it uses features this reader does not support.
+
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ID3Error('File too short.')
+
+        magic, version, _, flags, size = _HEADER.unpack(header)
+        if magic != b'ID3':
+            raise ID3Error('No ID3v2 tag.')
+        if version not in (3, 4):
+            raise ID3Error(f'Unsupported ID3v2.{version} tag.')
+
+        # Tag wide unsynchronisation shifts every frame
+        if flags & 0x80:
+            raise ID3Error('Unsynchronised tag.')
+
+        end = _HEADER.size + _synchsafe(size)
+        if end > os.fstat(f.fileno()).st_size:
+            raise ID3Error('Tag exceeds the file.')
+
+        if flags & 0x40:
+            extended = _read(f, 4)
+            if version == 4:
+                f.seek(_HEADER.size + _synchsafe(extended))
+            else:
+                f.seek(int.from_bytes(extended, 'big'), 1)
+
+        return _read_frames(f, version, end)
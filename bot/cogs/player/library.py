@@ -0,0 +1,681 @@
+import asyncio
+import ctypes
+import ctypes.util
+import itertools
+import os
+import random
+import sqlite3
+import struct
+
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from mutagen import MutagenError
+from mutagen.id3 import ID3
+from mutagen.mp3 import MP3
+
+from .id3 import ID3Error, read_tags
+from .mpeg import read_length
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
+
+# inotify flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class TrackMetadata(NamedTuple):
+    """Metadata describing a local MP3 file."""
+    path: str
+    size: int
+    mtime: int
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    date: Optional[str] = None
+    length: float = 0.0
+    cover_offset: Optional[int] = None
+    cover_length: Optional[int] = None
+
+
+def _read_metadata_mutagen(path: Path, stat: os.stat_result) -> TrackMetadata:
+    tags = MP3(str(path))
+
+    text = dict()
+    for attribute, tag in (('title', 'TIT2'), ('artist', 'TPE1'), ('album', 'TALB'), ('date', 'TDRC')):
+        data = tags.get(tag)
+        if data is not None:
+            text[attribute] = str(data[0])
+
+    return TrackMetadata(str(path), stat.st_size, stat.st_mtime_ns, length=tags.info.length, **text)
+
+
+def read_metadata(path: Path, stat: os.stat_result = None) -> TrackMetadata:
+    """Reads the metadata of an MP3 file.
+
+    Tags are read with a minimal ID3v2 reader and the length is determined from the MPEG frame headers,
+    falling back to mutagen for files which cannot be handled.
+
+    Args:
+        path (pathlib.Path): The MP3 file to read.
+        stat (os.stat_result): The result of stat-ing the file, if already known.
+
+    """
+    stat = stat or path.stat()
+
+    try:
+        tags = read_tags(path)
+    except ID3Error:
+        return _read_metadata_mutagen(path, stat)
+
+    length = read_length(path, tags.tag_size)
+    if length is None:
+        return _read_metadata_mutagen(path, stat)
+
+    return TrackMetadata(
+        str(path), stat.st_size, stat.st_mtime_ns, length=length,
+        cover_offset=tags.cover_offset, cover_length=tags.cover_length, **tags.text
+    )
+
+
+def read_cover(metadata: TrackMetadata) -> Optional[BytesIO]:
+    """Reads the cover art embedded in an MP3 file, if it has any."""
+    if metadata.cover_offset is not None:
+        try:
+            with open(metadata.path, 'rb') as f:
+                f.seek(metadata.cover_offset)
+                return BytesIO(f.read(metadata.cover_length))
+        except OSError:
+            return None
+
+    try:
+        tags = ID3(metadata.path)
+    except (OSError, MutagenError):
+        return None
+
+    for frame in tags.getall('APIC'):
+        return BytesIO(frame.data)
+    return None
+
+
+class MetadataCache:
+    """An in-memory least recently used cache of MP3 metadata.
+
+    Entries are re-read once the file's size or modification time changes.
+
+    Args:
+        maxsize (int): The maximum number of entries to hold.
+
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: Path) -> TrackMetadata:
+        """Retrieves a file's metadata, reading the file if it is not cached or has changed."""
+        stat = path.stat()
+
+        metadata = self._entries.get(path)
+        if metadata is not None and metadata.size == stat.st_size and metadata.mtime == stat.st_mtime_ns:
+            self._entries.move_to_end(path)
+            return metadata
+
+        metadata = self._entries[path] = read_metadata(path, stat)
+        self._entries.move_to_end(path)
+
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        return metadata
+
+
+class LibraryCache:
+    """A persistent cache of MP3 metadata backed by a SQLite database.
+
+    Entries are keyed by path and are only considered valid while the file's size and modification time are unchanged.
+    The cache may be used from any thread, but only from one thread at a time.
+
+    Args:
+        filename (str): The SQLite database to store the cache in.
+
+    """
+    _schema_version = 3
+
+    def __init__(self, filename: str):
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+
+        version, = self._connection.execute('PRAGMA user_version').fetchone()
+        if version != self._schema_version:
+            with self._connection:
+                self._connection.execute('DROP TABLE IF EXISTS tracks')
+                self._connection.execute(f'PRAGMA user_version = {self._schema_version}')
+
+        self._connection.execute(f'CREATE TABLE IF NOT EXISTS tracks ({", ".join(TrackMetadata._fields)}, PRIMARY KEY (path))')
+        self._entries: Dict[str, TrackMetadata] = {
+            row[0]: TrackMetadata(*row) for row in self._connection.execute('SELECT * FROM tracks')
+        }
+        self._pending: Dict[str, TrackMetadata] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, path: Path, stat: os.stat_result) -> Optional[TrackMetadata]:
+        """Retrieves a file's cached metadata if it is still up to date."""
+        metadata = self._entries.get(str(path))
+        if metadata is not None and metadata.size == stat.st_size and metadata.mtime == stat.st_mtime_ns:
+            return metadata
+        return None
+
+    def put(self, metadata: TrackMetadata) -> TrackMetadata:
+        """Stores a file's metadata, it is written to disk on the next commit."""
+        self._entries[metadata.path] = self._pending[metadata.path] = metadata
+        return metadata
+
+    def check(self, paths: Iterable[Path]) -> Tuple[List[TrackMetadata], List[Path]]:
+        """Splits files into those with up to date cached metadata, and those which need to be read.
+
+        Returns:
+            `tuple`: The up to date cached metadata and the paths of the files which need to be read.
+
+        """
+        cached, changed = list(), list()
+        for path in paths:
+            try:
+                metadata = self.get(path, path.stat())
+            except FileNotFoundError:
+                continue
+
+            if metadata is not None:
+                cached.append(metadata)
+            else:
+                changed.append(path)
+
+        return cached, changed
+
+    def prune(self, directory: Path, paths: Iterable[Path]):
+        """Removes the entries of every file within directory which is not in paths."""
+        keep = {str(path) for path in paths}
+        removed = [(path,) for path in self._entries if path not in keep and directory in Path(path).parents]
+
+        for path, in removed:
+            del self._entries[path]
+            self._pending.pop(path, None)
+
+        with self._connection:
+            self._connection.executemany('DELETE FROM tracks WHERE path = ?', removed)
+
+    def commit(self):
+        """Writes any changed entries to disk."""
+        if not self._pending:
+            return
+
+        with self._connection:
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO tracks VALUES ({", ".join("?" * len(TrackMetadata._fields))})', self._pending.values())
+        self._pending.clear()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+
+def _is_mp3(path: Path) -> bool:
+    return path.suffix.lower() == '.mp3'
+
+
+def _walk(directory: Path) -> Tuple[List[Path], List[Path]]:
+    """Lists every directory and MP3 file within a directory."""
+    directories, files = list(), list()
+    for root, _, filenames in os.walk(directory):
+        directories.append(Path(root))
+        files.extend(Path(root, filename) for filename in filenames if _is_mp3(Path(filename)))
+    return directories, files
+
+
+def _read_all(paths: Iterable[Path]) -> Tuple[List[TrackMetadata], List[Path]]:
+    """Reads the metadata of several MP3 files, returning the metadata read and the paths which could not be read."""
+    tracks, failed = list(), list()
+    for path in paths:
+        try:
+            tracks.append(read_metadata(path))
+        except FileNotFoundError:
+            pass
+        # A damaged file must not fail the rest of the chunk
+        except Exception:
+            failed.append(path)
+    return tracks, failed
+
+
+class Library:
+    """An in-memory view of the MP3 files within a directory.
+
+    Libraries are shared, use `Library.get` to retrieve the library for a directory.
+
+    Changes to the library are published to subscribers as a path and its new metadata,
+    the metadata is `None` when a track is removed.
+
+    Args:
+        directory (str): The directory containing the MP3 files.
+
+    Kwargs:
+        history (int): How many of the most recently picked tracks `next_track` avoids repeating.
+
+    """
+    _instances: Dict[Path, 'Library'] = dict()
+
+    def __init__(self, directory: str, *, history: int = 50):
+        self.directory = Path(directory).absolute()
+        self.tracks: Dict[Path, TrackMetadata] = dict()
+        self.loaded = False
+
+        self._paths: List[Path] = list()
+        self._positions: Dict[Path, int] = dict()
+        self._subscribers: List[Callable[[Path, Optional[TrackMetadata]], None]] = list()
+
+        self._bag: List[Path] = list()
+        self._history: Deque[Path] = deque(maxlen=history)
+
+    @classmethod
+    def get(cls, directory: str) -> 'Library':
+        """Retrieves the shared library for a directory, creating it if needed."""
+        directory = Path(directory).absolute()
+        if directory not in cls._instances:
+            cls._instances[directory] = cls(directory)
+        return cls._instances[directory]
+
+    @classmethod
+    def all(cls) -> List['Library']:
+        """Retrieves every shared library."""
+        return list(cls._instances.values())
+
+    @classmethod
+    def lookup(cls, path: Path) -> Optional[TrackMetadata]:
+        """Retrieves a track's metadata from the shared library containing it, without reading the file.
+
+        Returns:
+            `TrackMetadata`: The track's metadata, or `None` if no library has loaded the track.
+
+        """
+        path = path.absolute()
+        for library in cls._instances.values():
+            metadata = library.tracks.get(path)
+            if metadata is not None:
+                return metadata
+        return None
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._positions
+
+    def subscribe(self, callback: Callable[[Path, Optional[TrackMetadata]], None]):
+        """Registers a callback to be called whenever a track is added, changed or removed."""
+        self._subscribers.append(callback)
+
+    def _publish(self, path: Path, metadata: Optional[TrackMetadata]):
+        for callback in self._subscribers:
+            callback(path, metadata)
+
+    def add(self, metadata: TrackMetadata):
+        """Adds or updates a track."""
+        path = Path(metadata.path)
+        if path not in self._positions:
+            self._positions[path] = len(self._paths)
+            self._paths.append(path)
+
+            # Shuffle the new track into the bag
+            self._bag.append(path)
+            index = random.randrange(len(self._bag))
+            self._bag[index], self._bag[-1] = self._bag[-1], self._bag[index]
+
+        self.tracks[path] = metadata
+        self._publish(path, metadata)
+
+    def remove(self, path: Path):
+        """Removes a track, if present."""
+        position = self._positions.pop(path, None)
+        if position is None:
+            return
+
+        # Swap the last path into the removed slot
+        last = self._paths.pop()
+        if last != path:
+            self._paths[position] = last
+            self._positions[last] = position
+
+        del self.tracks[path]
+        self._publish(path, None)
+
+    def remove_directory(self, directory: Path):
+        """Removes every track within a directory."""
+        for path in [path for path in self._paths if directory in path.parents]:
+            self.remove(path)
+
+    def _refill(self):
+        self._bag = list(self._paths)
+        random.shuffle(self._bag)
+
+        # Move recently picked tracks away from the end of the bag
+        window = min(len(self._history), len(self._bag) // 2)
+        recent = set(itertools.islice(self._history, len(self._history) - window, None))
+        for index in range(len(self._bag) - window, len(self._bag)):
+            for _ in range(8):
+                if self._bag[index] not in recent:
+                    break
+                swap = random.randrange(len(self._bag) - window)
+                self._bag[index], self._bag[swap] = self._bag[swap], self._bag[index]
+
+        # The last track picked is never picked again straight away
+        if len(self._bag) > 1 and self._history and self._bag[-1] == self._history[-1]:
+            swap = random.randrange(len(self._bag) - max(window, 1))
+            self._bag[-1], self._bag[swap] = self._bag[swap], self._bag[-1]
+
+    def next_track(self) -> Optional[Path]:
+        """Picks a random track from the library.
+
+        Tracks are picked without replacement, every track is picked once before any track is picked again.
+        """
+        while self._paths:
+            if not self._bag:
+                self._refill()
+
+            # Removed tracks are only discarded from the bag once reached
+            path = self._bag.pop()
+            if path in self._positions:
+                self._history.append(path)
+                return path
+
+        return None
+
+    async def scan(self, cache_file: str, *, executor: Executor = None, chunk_size: int = 256,
+                   progress: Callable[[int, int], None] = None):
+        """Reads the metadata of every track in the directory.
+
+        Cached metadata is added to the library first, files which are new or have changed
+        are then read in chunks by the executor and added to the library as each chunk completes.
+
+        Args:
+            cache_file (str): The location of the library's metadata cache.
+
+        Kwargs:
+            executor (concurrent.futures.Executor): The executor to read files with, ideally a process pool.
+            chunk_size (int): How many files to read per executor job.
+            progress (Callable[[int, int], None]): Called with the number of files read and the number to read,
+                once the cached metadata has been added and after each chunk.
+
+        """
+        loop = asyncio.get_event_loop()
+
+        cache = await loop.run_in_executor(None, LibraryCache, cache_file)
+        try:
+            _, paths = await loop.run_in_executor(None, _walk, self.directory)
+            cached, changed = await loop.run_in_executor(None, cache.check, paths)
+
+            found = set(paths)
+            for path in [path for path in self._paths if path not in found]:
+                self.remove(path)
+
+            for metadata in cached:
+                if self.tracks.get(Path(metadata.path)) != metadata:
+                    self.add(metadata)
+
+            done = 0
+            if progress is not None:
+                progress(done, len(changed))
+
+            chunks = [changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size)]
+            for future in asyncio.as_completed([loop.run_in_executor(executor, _read_all, chunk) for chunk in chunks]):
+                tracks, failed = await future
+                for metadata in tracks:
+                    self.add(cache.put(metadata))
+
+                done += len(tracks) + len(failed)
+                if progress is not None:
+                    progress(done, len(changed))
+
+            await loop.run_in_executor(None, cache.prune, self.directory, paths)
+
+        finally:
+            await loop.run_in_executor(None, cache.close)
+
+        self.loaded = True
+
+
+class LibraryWatcher:
+    """Keeps a library up to date as files are added, changed, moved or removed.
+
+    Changes are detected with inotify where available,
+    otherwise the modification times of the library's directories are polled.
+
+    Args:
+        library (Library): The library to keep up to date.
+
+    Kwargs:
+        interval (float): How often in seconds to poll for changes when inotify is unavailable.
+
+    """
+
+    def __init__(self, library: Library, *, interval: float = 60):
+        self.library = library
+        self.interval = interval
+
+        self._fd: Optional[int] = None
+        self._watches: Dict[int, Path] = dict()
+        self._moves: Dict[int, TrackMetadata] = dict()
+
+        self._directories: Dict[Path, int] = dict()
+        self._files: Dict[Path, Set[Path]] = dict()
+        self._retry: Set[Path] = set()
+
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._fd is not None or self._task is not None
+
+    def start(self):
+        """Starts watching the library's directory."""
+        if self.running:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        if _libc is not None:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                loop.add_reader(fd, self._read_events)
+                self._task = loop.create_task(self._add_directory(self.library.directory, initial=True))
+                return
+
+        self._task = loop.create_task(self._poll())
+
+    def stop(self):
+        """Stops watching the library's directory."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._fd is not None:
+            asyncio.get_event_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            self._watches.clear()
+
+    async def _load(self, paths: List[Path]):
+        tracks, _ = await asyncio.get_event_loop().run_in_executor(None, _read_all, paths)
+        for metadata in tracks:
+            self.library.add(metadata)
+
+    # region inotify
+
+    async def _add_directory(self, directory: Path, *, initial: bool = False):
+        directories, files = await asyncio.get_event_loop().run_in_executor(None, _walk, directory)
+
+        for path in directories:
+            wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), _INOTIFY_MASK)
+            if wd >= 0:
+                self._watches[wd] = path
+
+        # The initial contents of the library are loaded by a full scan
+        if not initial:
+            await self._load(files)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        loop = asyncio.get_event_loop()
+        added: List[Path] = list()
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + _INOTIFY_EVENT.size:offset + _INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += _INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                loop.create_task(self._resync())
+                continue
+
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = directory / os.fsdecode(name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    loop.create_task(self._add_directory(path))
+                elif mask & IN_MOVED_FROM:
+                    self.library.remove_directory(path)
+                continue
+
+            if not _is_mp3(path):
+                continue
+
+            if mask & IN_MOVED_FROM:
+                metadata = self.library.tracks.get(path)
+                if metadata is not None:
+                    self._moves[cookie] = metadata
+                self.library.remove(path)
+
+            elif mask & IN_MOVED_TO and cookie in self._moves:
+                self.library.add(self._moves.pop(cookie)._replace(path=str(path)))
+
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                added.append(path)
+
+            elif mask & IN_DELETE:
+                self.library.remove(path)
+
+        # Moves out of the library are never paired
+        self._moves.clear()
+
+        if added:
+            loop.create_task(self._load(added))
+
+    async def _resync(self):
+        _, files = await asyncio.get_event_loop().run_in_executor(None, _walk, self.library.directory)
+        files = set(files)
+
+        for path in [path for path in self.library.tracks if path not in files]:
+            self.library.remove(path)
+
+        await self._load([path for path in files if path not in self.library])
+
+    # endregion
+
+    # region polling
+
+    def _scan_directory(self, directory: Path, added: List[Path], removed: List[Path]):
+        """Lists a directory, recording which MP3 files have appeared or disappeared since it was last listed."""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            self._directories.pop(directory, None)
+            removed.extend(self._files.pop(directory, ()))
+            return
+
+        self._directories[directory] = mtime
+
+        files = set()
+        for entry in entries:
+            path = Path(entry.path)
+            if entry.is_dir():
+                if path not in self._directories:
+                    self._scan_directory(path, added, removed)
+            elif _is_mp3(path):
+                files.add(path)
+
+        previous = self._files.get(directory, set())
+        added.extend(files - previous)
+        removed.extend(previous - files)
+        self._files[directory] = files
+
+    def _changes(self) -> Tuple[List[TrackMetadata], List[Path]]:
+        added, removed = list(self._retry), list()
+
+        for directory, mtime in list(self._directories.items()):
+            try:
+                changed = os.stat(directory).st_mtime_ns != mtime
+            except FileNotFoundError:
+                changed = True
+
+            if changed:
+                self._scan_directory(directory, added, removed)
+
+        # Files which could not be read may still be being written
+        tracks, failed = _read_all(set(added))
+        self._retry = set(failed)
+        return tracks, removed
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._scan_directory, self.library.directory, list(), list())
+
+        while True:
+            await asyncio.sleep(self.interval)
+
+            tracks, removed = await loop.run_in_executor(None, self._changes)
+
+            for path in removed:
+                self.library.remove(path)
+
+            for metadata in tracks:
+                self.library.add(metadata)
+
+    # endregion
@@ -0,0 +1,136 @@
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# How much audio is searched for the first frame
+MAX_SYNC_SEARCH = 64 * 1024
+
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+
+class FrameHeader(NamedTuple):
+    """An MPEG audio frame header."""
+    version: float
+    layer: int
+    bitrate: int
+    sample_rate: int
+    padding: int
+    mono: bool
+
+    @property
+    def samples(self) -> int:
+        """The number of samples in the frame."""
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and self.version != 1:
+            return 576
+        return 1152
+
+    @property
+    def size(self) -> int:
+        """The size of the frame in bytes."""
+        if self.layer == 1:
+            return (12 * self.bitrate // self.sample_rate + self.padding) * 4
+        return self.samples // 8 * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_size(self) -> int:
+        """The size of the layer III side information following the header."""
+        if self.version == 1:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+
+def parse_frame_header(data: bytes) -> Optional[FrameHeader]:
+    """Parses a 4 byte MPEG audio frame header, returning `None` if it is invalid."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return None
+
+    version = {0: 2.5, 2: 2, 3: 1}.get(data[1] >> 3 & 0x03)
+    layer = 4 - (data[1] >> 1 & 0x03)
+    bitrate_index = data[2] >> 4
+    sample_rate_index = data[2] >> 2 & 0x03
+
+    if version is None or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    return FrameHeader(
+        version=version,
+        layer=layer,
+        bitrate=BITRATES[min(version, 2), layer][bitrate_index] * 1000,
+        sample_rate=SAMPLE_RATES[version][sample_rate_index],
+        padding=data[2] >> 1 & 0x01,
+        mono=data[3] >> 6 == 0x03
+    )
+
+
+def _vbr_frames(header: FrameHeader, frame: bytes) -> Optional[int]:
+    """Reads the number of frames from a Xing, Info or VBRI header."""
+    offset = 4 + header.side_info_size
+    if frame[offset:offset + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(frame[offset + 4:offset + 8], 'big')
+        if flags & 0x01:
+            return int.from_bytes(frame[offset + 8:offset + 12], 'big')
+        return None
+
+    if frame[36:40] == b'VBRI':
+        return int.from_bytes(frame[50:54], 'big')
+
+    return None
+
+
+def read_length(path: Path, offset: int = 0) -> Optional[float]:
+    """Determines the length in seconds of an MP3 file from its frame headers.
+
+    VBR files are measured using their Xing, Info or VBRI header,
+    otherwise the file is assumed to have a constant bitrate.
+
+    Args:
+        path (pathlib.Path): The MP3 file to measure.
+        offset (int): Where the audio starts, usually the size of the ID3v2 tag.
+
+    Returns:
+        `float`: The length of the file, or `None` if no MPEG audio frames were found.
+
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        end = f.tell()
+
+        # Exclude an ID3v1 tag
+        if end >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b'TAG':
+                end -= 128
+
+        f.seek(offset)
+        data = f.read(MAX_SYNC_SEARCH)
+
+    position = data.find(b'\xff')
+    while position != -1:
+        header = parse_frame_header(data[position:position + 4])
+
+        # Confirm the sync by checking the following frame when possible
+        if header is not None:
+            following = position + header.size
+            if following + 4 > len(data) or parse_frame_header(data[following:following + 4]) is not None:
+                frames = _vbr_frames(header, data[position:following])
+                if frames is not None:
+                    return frames * header.samples / header.sample_rate
+                return (end - offset - position) * 8 / header.bitrate
+
+        position = data.find(b'\xff', position + 1)
+
+    return None
@@ -0,0 +1,28 @@
+from typing import Optional
+
+import wavelink
+
+
+def node_penalty(node: wavelink.Node) -> float:
+    """Scores how loaded a Lavalink node is, lower is better.
+
+    Uses the penalty calculated from the node's last stats update (players, CPU load and frame deficit),
+    or its player count if it has not reported stats yet.
+    """
+    stats = getattr(node, 'stats', None)
+    if stats is not None:
+        return stats.penalty.total
+    return len(node.players)
+
+
+def best_node(client: wavelink.Client, *, exclude: wavelink.Node = None) -> Optional[wavelink.Node]:
+    """Picks the least loaded available node.
+
+    Kwargs:
+        exclude (wavelink.Node): A node which should not be picked.
+
+    """
+    nodes = [node for node in client.nodes.values() if node.is_available and node is not exclude]
+    if not nodes:
+        return None
+    return min(nodes, key=node_penalty)
@@ -1,26 +1,73 @@
-from pathlib import Path
 from random import choice
 
-from typing import Optional
+from typing import Callable, Dict, List, Optional
 
+import discord
+
+from .library import Library
 from .track import Track, MP3Track
+from .tracklist import TrackList
 
 from bot.config import config as BOT_CONFIG
 COG_CONFIG = BOT_CONFIG.EXTENSIONS[__name__[:__name__.rindex('.')]]
 
+SCHEDULERS = ('fifo', 'round_robin', 'weighted')
+
 
 class Queue:
+    """The requests waiting to be played in a session.
+
+    The `scheduler` config option decides the order requests are played in:
+        fifo: In the order they were requested.
+        round_robin: Each requester with tracks in the queue takes turns.
+        weighted: Each requester with tracks in the queue gets an equal share of playing time.
+
+    The fair schedulers tag each request with the virtual time its requester's turn finishes,
+    the time a requester's turns start from catches up with the virtual time of the last track played,
+    so requesters who were idle do not build up turns.
+    Requests are kept in order of their tag, so `requests` is always in the order tracks will be played.
+    """
 
     def __init__(self, config=None):
         self.config = config or dict()
-        self.requests = list()
+        self.scheduler = self.config.get('scheduler') or 'fifo'
+        if self.scheduler not in SCHEDULERS:
+            raise ValueError(f'Unknown queue scheduler: {self.scheduler}')
+
+        self.requests = TrackList()
+        self._subscribers: List[Callable[[], None]] = list()
+
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[Optional[int], float] = dict()
+
+    def subscribe(self, callback: Callable[[], None]):
+        """Registers a callback to be called whenever the next track may have changed."""
+        self._subscribers.append(callback)
+
+    def _changed(self):
+        for callback in self._subscribers:
+            callback()
+
+    def peek(self) -> Optional[Track]:
+        """Returns the track `next_track` will return, without removing it."""
+        if self.requests:
+            return self.requests[0]
+        return None
 
     def next_track(self) -> Optional[Track]:
         if self.requests:
-            return self.requests.pop(0)
+            self._virtual_time = self.requests.tag(0)
+            if self.scheduler != 'fifo':
+                self._finish_tags = {requester: tag for requester, tag in self._finish_tags.items() if tag > self._virtual_time}
+            return self.requests.popleft()
         return None
 
-    def add_request(self, track: Track, *, at_start: bool = False):
+    def _cost(self, track: Track) -> float:
+        if self.scheduler == 'weighted':
+            return max(track.length, 1)
+        return 1
+
+    def add_request(self, track: Track, *, at_start: bool = False) -> int:
         """Adds a track to the list of requests.
 
         Args:
@@ -29,11 +76,43 @@ class Queue:
         Kwargs:
             at_start (bool): Determines wether the track should be added to the start of the queue.
 
+        Returns:
+            `int`: The position in the queue the track was added at.
+
         """
         if at_start:
-            self.requests.insert(0, track)
+            index = self.requests.appendleft(track, tag=self._virtual_time)
+        elif self.scheduler == 'fifo':
+            index = self.requests.append(track, tag=self._virtual_time)
         else:
-            self.requests.append(track)
+            requester = track.requester.id if track.requester is not None else None
+            tag = max(self._virtual_time, self._finish_tags.get(requester, 0.0)) + self._cost(track)
+            self._finish_tags[requester] = tag
+            index = self.requests.insort(track, tag)
+
+        self._changed()
+        return index
+
+    def next_request_by(self, user: discord.abc.User) -> Optional[int]:
+        """Returns the position in the queue of the next track requested by a user."""
+        return self.requests.first_requested_by(user)
+
+    def remove_request(self, index: int) -> Track:
+        """Removes the track at the specified index from the list of requests."""
+        tag = self.requests.tag(index)
+        track = self.requests.pop(index)
+
+        # The requester's next turn finishes after their last remaining request rather than the removed one
+        requester = track.requester.id if track.requester is not None else None
+        if self.scheduler != 'fifo' and self._finish_tags.get(requester) == tag:
+            last_tag = self.requests.last_tag_requested_by(requester)
+            if last_tag is not None and last_tag > self._virtual_time:
+                self._finish_tags[requester] = last_tag
+            else:
+                del self._finish_tags[requester]
+
+        self._changed()
+        return track
 
 
 class Radio(Queue):
@@ -43,11 +122,29 @@ class Radio(Queue):
 
         self.playlist_directory = self.config.get(
             'playlist_directory') or COG_CONFIG.DEFAULT_PLAYLIST_DIRECTORY
+        self.library = Library.get(self.playlist_directory)
+
+        self._upcoming: Optional[Track] = None
+
+    def _pick(self) -> Track:
+        path = self.library.next_track()
+
+        # Fall back to searching the directory until the library has loaded
+        if path is None:
+            path = choice(list(self.library.directory.glob('**/*.mp3')))
+
+        return MP3Track(str(path))
+
+    def peek(self) -> Track:
+        next_track = super().peek()
+        if next_track is None:
+            if self._upcoming is None:
+                self._upcoming = self._pick()
+            return self._upcoming
+        return next_track
 
     def next_track(self) -> Track:
         next_track = super().next_track()
         if next_track is None:
-            directory = Path(self.playlist_directory)
-            tracks = list(directory.glob('**/*.mp3'))
-            return MP3Track(str(choice(tracks)))
+            next_track, self._upcoming = self._upcoming or self._pick(), None
         return next_track
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import wavelink
+
+SEARCH_PREFIXES = ('ytsearch:', 'scsearch:')
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a Lavalink identifier so equivalent requests share a cache entry.
+
+    Search queries are case insensitive and ignore repeated whitespace, URLs are only stripped.
+    """
+    query = query.strip()
+    for prefix in SEARCH_PREFIXES:
+        if query.lower().startswith(prefix):
+            return prefix + ' '.join(query[len(prefix):].lower().split())
+    return query
+
+
+def is_search(query: str) -> bool:
+    """Determines whether a Lavalink identifier is a search query rather than a direct URL."""
+    return query.startswith(SEARCH_PREFIXES)
+
+
+class TrackResolver:
+    """Resolves Lavalink identifiers into tracks, caching the results.
+
+    Search results are only cached for a short time since they change,
+    tracks loaded from direct URLs are cached for longer.
+    The least recently used entries are evicted once the cache is full.
+
+    Concurrent requests for the same identifier share a single request to Lavalink.
+    The cache can be saved to and loaded from disk so it survives restarts.
+
+    Args:
+        client (wavelink.Client): The wavelink client to resolve tracks with.
+
+    Kwargs:
+        max_size (int): The maximum number of cached identifiers.
+        search_ttl (float): How long in seconds to cache search results.
+        track_ttl (float): How long in seconds to cache tracks loaded from direct URLs.
+
+    """
+
+    def __init__(self, client: wavelink.Client, *, max_size: int = 2048, search_ttl: float = 3600, track_ttl: float = 86400):
+        self.client = client
+        self.max_size = max_size
+        self.search_ttl = search_ttl
+        self.track_ttl = track_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._entries: OrderedDict = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = dict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _get(self, key: str) -> Optional[List[Tuple[str, dict]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, tracks = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return tracks
+
+    def _put(self, key: str, tracks: List[Tuple[str, dict]], ttl: float):
+        self._entries[key] = (time.time() + ttl, tracks)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every cached entry."""
+        self._entries.clear()
+
+    @staticmethod
+    def _read(filename: str) -> List[Tuple[str, float, str]]:
+        with sqlite3.connect(filename) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, expires_at REAL, tracks TEXT, position INTEGER)')
+            return connection.execute(
+                'SELECT key, expires_at, tracks FROM tracks WHERE expires_at > ? ORDER BY position', (time.time(),)
+            ).fetchall()
+
+    @staticmethod
+    def _write(filename: str, rows: List[Tuple[str, float, str, int]]):
+        with sqlite3.connect(filename) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, expires_at REAL, tracks TEXT, position INTEGER)')
+            connection.execute('DELETE FROM tracks')
+            connection.executemany('INSERT INTO tracks VALUES (?, ?, ?, ?)', rows)
+
+    async def load(self, filename: str):
+        """Loads unexpired entries saved by `save`, entries already cached take precedence."""
+        rows = await asyncio.get_event_loop().run_in_executor(None, self._read, filename)
+
+        entries = OrderedDict((key, (expires_at, [tuple(track) for track in json.loads(tracks)])) for key, expires_at, tracks in rows)
+        entries.update(self._entries)
+        self._entries = entries
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def save(self, filename: str):
+        """Saves every unexpired entry to a SQLite database, replacing its previous contents."""
+        now = time.time()
+        rows = [
+            (key, expires_at, json.dumps(tracks), position)
+            for position, (key, (expires_at, tracks)) in enumerate(self._entries.items()) if expires_at > now
+        ]
+        await asyncio.get_event_loop().run_in_executor(None, self._write, filename, rows)
+
+    async def get_tracks(self, query: str) -> Optional[List[wavelink.Track]]:
+        """Resolves a Lavalink identifier, see `wavelink.Client.get_tracks`.
+
+        Returns:
+            `list` of `wavelink.Track`: A new list of the tracks found, or `None` if none were found.
+
+        """
+        key = normalize_query(query)
+
+        tracks = self._get(key)
+        if tracks is not None:
+            self.hits += 1
+            return [wavelink.Track(track_id, info) for track_id, info in tracks]
+
+        self.misses += 1
+
+        request = self._in_flight.get(key)
+        if request is None:
+            request = self._in_flight[key] = asyncio.ensure_future(self._load(key, query))
+            request.add_done_callback(partial(self._request_done, key))
+        else:
+            self.coalesced += 1
+
+        # Cancelling one caller must not cancel the request for the others
+        data = await asyncio.shield(request)
+
+        if isinstance(data, list):
+            return list(data)
+        return data
+
+    def _request_done(self, key: str, request: asyncio.Future):
+        if self._in_flight.get(key) is request:
+            del self._in_flight[key]
+
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not request.cancelled():
+            request.exception()
+
+    async def _load(self, key: str, query: str):
+        data = await self.client.get_tracks(query)
+
+        # Playlists and failed loads are not cached
+        if not isinstance(data, list) or not data:
+            return data
+
+        self._put(key, [(track.id, track.info) for track in data], self.search_ttl if is_search(key) else self.track_ttl)
+        return data
@@ -0,0 +1,355 @@
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import pickle
+import re
+import socket
+import struct
+
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, List, Optional, Set
+
+from fuzzywuzzy import fuzz
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits track metadata into the words used to index it."""
+    return re.sub(r'[^\w\s]', '', text).split(' ')
+
+
+def tokenize_query(text: str) -> List[str]:
+    """Splits a search query into the words used to search the index."""
+    return [word.lower() for word in re.sub(r'[^\w\s]', '', text).split()]
+
+
+def trigrams(word: str) -> Set[str]:
+    """Returns the trigrams of a word, padded so short words and the start and end of words are weighted more."""
+    padded = f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """An inverted index over the words describing each track.
+
+    Each unique word is stored once in the vocabulary with a postings list of the tracks containing it,
+    so a query word is only fuzzy scored once per vocabulary term rather than once per word of every track.
+
+    Vocabulary terms are additionally indexed by the characters they contain,
+    terms which share no characters with a query word always score 0 and are never considered.
+
+    Setting `min_ratio` trades exact ranking for speed, only terms scoring at least `min_ratio` count towards a track's score
+    and terms are indexed by their trigrams instead, only terms sharing at least a third of a query word's trigrams are fuzzy scored.
+
+    The scores of each track against recently searched words are kept up to date as tracks are added and removed,
+    so a query only scores the words which were not recently searched, and search results are cached until the index changes.
+
+    Kwargs:
+        max_results (int): The maximum number of search results to cache.
+        max_words (int): The maximum number of query words to keep track scores for.
+        min_ratio (int): The minimum ratio between a query word and a term for the term to count towards a track's score,
+            0 to rank tracks exactly.
+
+    """
+
+    def __init__(self, *, max_results: int = 256, max_words: int = 32, min_ratio: int = 0):
+        self.max_results = max_results
+        self.max_words = max_words
+        self.min_ratio = min_ratio
+
+        self._postings: Dict[str, Dict[Hashable, int]] = dict()
+        self._grams: Dict[str, Set[str]] = dict()
+        self._documents: Dict[Hashable, Counter] = dict()
+        self._lengths: Dict[Hashable, int] = dict()
+        self._order: Dict[Hashable, int] = dict()
+        self._counter = itertools.count()
+
+        self._results: OrderedDict = OrderedDict()
+        self._ratios: OrderedDict = OrderedDict()
+        self._scores: Dict[str, Dict[Hashable, int]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._lengths
+
+    def add(self, key: Hashable, words: List[str]):
+        """Adds a track to the index.
+
+        Args:
+            key (Hashable): The key to return when this track matches a search.
+            words (list of str): The words describing the track.
+
+        """
+        if key in self:
+            self.remove(key)
+
+        terms = Counter(word.lower() for word in words)
+
+        for term, count in terms.items():
+            if term not in self._postings:
+                self._postings[term] = dict()
+                for gram in self._split(term):
+                    self._grams.setdefault(gram, set()).add(term)
+                for word, ratios in self._ratios.items():
+                    ratio = self._ratio(word, term)
+                    if ratio:
+                        ratios[term] = ratio
+            self._postings[term][key] = count
+
+        for word, ratios in self._ratios.items():
+            score = sum(ratios[term] * count for term, count in terms.items() if term in ratios)
+            if score:
+                self._scores[word][key] = score
+
+        self._documents[key] = terms
+        self._lengths[key] = len(words)
+        self._order[key] = next(self._counter)
+        self._results.clear()
+
+    def remove(self, key: Hashable):
+        """Removes a track from the index."""
+        terms = self._documents.pop(key, None)
+        if terms is None:
+            return
+
+        for term in terms:
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+                for gram in self._split(term):
+                    self._grams[gram].discard(term)
+                    if not self._grams[gram]:
+                        del self._grams[gram]
+                for ratios in self._ratios.values():
+                    ratios.pop(term, None)
+
+        for scores in self._scores.values():
+            scores.pop(key, None)
+
+        del self._lengths[key]
+        del self._order[key]
+        self._results.clear()
+
+    def clear(self):
+        """Removes every track from the index."""
+        self.__init__(max_results=self.max_results, max_words=self.max_words, min_ratio=self.min_ratio)
+
+    def _split(self, term: str) -> Set[str]:
+        """Returns the grams a term is indexed by, its trigrams if `min_ratio` is set, otherwise its characters."""
+        return trigrams(term) if self.min_ratio else set(term)
+
+    def _min_overlap(self, grams: Set[str]) -> int:
+        return max(1, len(grams) // 3) if self.min_ratio else 1
+
+    def _ratio(self, word: str, term: str) -> int:
+        """Scores a query word against a term, returning 0 if the term does not count towards a track's score."""
+        grams = self._split(word)
+        if len(grams & self._split(term)) < self._min_overlap(grams):
+            return 0
+        ratio = fuzz.ratio(word, term)
+        return ratio if ratio >= self.min_ratio else 0
+
+    def _candidates(self, word: str) -> Set[str]:
+        """Returns the vocabulary terms sharing enough grams with a query word."""
+        grams = self._split(word)
+        overlaps: Counter = Counter()
+        for gram in grams:
+            overlaps.update(self._grams.get(gram, ()))
+
+        min_overlap = self._min_overlap(grams)
+        return {term for term, overlap in overlaps.items() if overlap >= min_overlap}
+
+    def _word_scores(self, word: str) -> Dict[Hashable, int]:
+        """Returns the score of every track matching a query word, scoring the word against the index if it was not recently searched."""
+        if word in self._ratios:
+            self._ratios.move_to_end(word)
+            return self._scores[word]
+
+        ratios = dict()
+        for term in self._candidates(word):
+            ratio = fuzz.ratio(word, term)
+            if ratio and ratio >= self.min_ratio:
+                ratios[term] = ratio
+
+        scores: Dict[Hashable, int] = dict()
+        for term, ratio in ratios.items():
+            for key, count in self._postings[term].items():
+                scores[key] = scores.get(key, 0) + ratio * count
+
+        self._ratios[word] = ratios
+        self._scores[word] = scores
+        if len(self._ratios) > self.max_words:
+            evicted, _ = self._ratios.popitem(last=False)
+            del self._scores[evicted]
+
+        return scores
+
+    def search(self, query: str, limit: int) -> List[Hashable]:
+        """Searches the index.
+
+        A track's score is the sum of the ratios between each query word and each of the track's words, counting only those scoring at least `min_ratio`,
+        divided by the number of words describing the track.
+
+        Args:
+            query (str): The search query.
+            limit (int): The maximum number of results to return.
+
+        Returns:
+            `list`: The keys of the best matching tracks, best match first.
+            Tracks with equal scores are returned in the order they were added.
+
+        """
+        words = tuple(tokenize_query(query))
+
+        results = self._results.get((words, limit))
+        if results is not None:
+            self._results.move_to_end((words, limit))
+            return list(results)
+
+        # Start from the largest score vector so only the smaller ones are added key by key
+        vectors = sorted((self._word_scores(word) for word in words), key=len, reverse=True)
+        scores: Dict[Hashable, int] = dict(vectors[0]) if vectors else dict()
+        for vector in vectors[1:]:
+            for key, score in vector.items():
+                scores[key] = scores.get(key, 0) + score
+
+        results = heapq.nlargest(limit, scores, key=lambda key: (scores[key] / self._lengths[key], -self._order[key]))
+
+        # Pad with tracks which did not match at all
+        if len(results) < limit:
+            for key in self._lengths:
+                if key not in scores:
+                    results.append(key)
+                    if len(results) >= limit:
+                        break
+
+        self._results[words, limit] = results
+        if len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+        return list(results)
+
+
+_FRAME_HEADER = struct.Struct('>I')
+
+
+def _frame(message) -> bytes:
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+def _serve(sock: socket.socket, min_ratio: int):
+    """Runs a search index in a worker process, serving requests sent over a socket."""
+    index = SearchIndex(min_ratio=min_ratio)
+
+    with sock, sock.makefile('rb') as reader:
+        while True:
+            header = reader.read(_FRAME_HEADER.size)
+            if len(header) < _FRAME_HEADER.size:
+                return
+
+            operation, *args = pickle.loads(reader.read(_FRAME_HEADER.unpack(header)[0]))
+
+            if operation == 'add':
+                index.add(*args)
+            elif operation == 'remove':
+                index.remove(*args)
+            elif operation == 'search':
+                request_id, query, limit = args
+                sock.sendall(_frame((request_id, index.search(query, limit))))
+
+
+class SearchWorker:
+    """A search index running in a separate process.
+
+    Index updates are sent without waiting for a response,
+    they are applied in order so a search always sees every update sent before it.
+
+    Kwargs:
+        min_ratio (int): See `SearchIndex`.
+
+    """
+
+    def __init__(self, *, min_ratio: int = 0):
+        self.min_ratio = min_ratio
+        self._process: Optional[multiprocessing.Process] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._requests: Dict[int, asyncio.Future] = dict()
+        self._counter = itertools.count()
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def start(self):
+        """Starts the worker process."""
+        parent, child = socket.socketpair()
+
+        self._process = multiprocessing.Process(target=_serve, args=(child, self.min_ratio), daemon=True)
+        self._process.start()
+        child.close()
+
+        self._reader, self._writer = await asyncio.open_connection(sock=parent)
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    def stop(self):
+        """Stops the worker process."""
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._process is not None:
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.terminate()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(_FRAME_HEADER.size)
+                request_id, result = pickle.loads(await self._reader.readexactly(_FRAME_HEADER.unpack(header)[0]))
+
+                future = self._requests.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(result)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(RuntimeError('The search worker stopped.'))
+            self._requests.clear()
+
+            if self._writer is not None:
+                self._writer.close()
+
+    def _send(self, *message):
+        if not self.running:
+            raise RuntimeError('The search worker is not running.')
+        self._writer.write(_frame(message))
+
+    def add(self, key: Hashable, words: List[str]):
+        """Adds a track to the worker's index, see `SearchIndex.add`."""
+        self._send('add', key, words)
+
+    def remove(self, key: Hashable):
+        """Removes a track from the worker's index, see `SearchIndex.remove`."""
+        self._send('remove', key)
+
+    async def search(self, query: str, limit: int) -> List[Hashable]:
+        """Searches the worker's index, see `SearchIndex.search`."""
+        request_id = next(self._counter)
+        future = self._requests[request_id] = asyncio.get_event_loop().create_future()
+
+        try:
+            self._send('search', request_id, query, limit)
+            return await future
+        finally:
+            self._requests.pop(request_id, None)
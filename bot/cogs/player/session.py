@@ -1,23 +1,28 @@
 import asyncio
+import time
 
 from contextlib import suppress
-from typing import Generator, List
+from typing import Dict, Optional, Set
 
 import discord
 from discord.ext import commands
 
+from .nodes import best_node
 from .queue import Queue, Radio
 from .track import Track
 
 from bot.config import config as BOT_CONFIG
 COG_CONFIG = BOT_CONFIG.EXTENSIONS[__name__[:__name__.rindex('.')]]
 
+# How long in seconds to wait for Lavalink to report the position of a resumed player
+RESUME_TIMEOUT = 15
+
 
 class Session:
 
     def __init__(self, bot: discord.Client, voice_channel: discord.VoiceChannel, *,
                  log_channel: discord.TextChannel = None, run_forever: bool = False, stoppable: bool = True,
-                 request: Track = None, **kwargs):
+                 request: Track = None, snapshot: Dict = None, resumed: bool = False, **kwargs):
         """
 
         Args:
@@ -27,23 +32,35 @@ class Session:
             log_channel (discord.TextChannel): Specifies a channel to log playback history.
             run_forever (bool): Determines wether the session should run forever.
             stoppable (bool): Determines wether the session should be able to be stopped by a user.
+            snapshot (dict): A snapshot made by `Session.snapshot` to restore the session's state from.
+            resumed (bool): Determines wether the snapshot's player is still held by a resumed Lavalink session.
 
         """
         self.bot = bot
         self.guild = voice_channel.guild
-        self.player = self.bot._wavelink.get_player(voice_channel.guild.id)
+
+        # Start new players on the least loaded node, resumed players stay on the node playing them
+        node = best_node(self.bot._wavelink)
+        if resumed and snapshot.get('node') in self.bot._wavelink.nodes:
+            node = self.bot._wavelink.nodes[snapshot['node']]
+        self.player = self.bot._wavelink.get_player(voice_channel.guild.id, node_id=node.identifier if node is not None else None)
 
         self.log_channel = log_channel
         self.stoppable = stoppable
         self.config = kwargs
-        self.queue_config = self.config.get('queue')
+        self.queue_config = self.config.get('queue') or {'scheduler': COG_CONFIG.QUEUE_SCHEDULERS.get(self.guild.id)}
 
         self.not_alone = asyncio.Event()
         self.timeout = self.config.get('timeout') or COG_CONFIG.DEFAULT_TIMEOUT
 
-        self.skip_requests: List[discord.User] = list()
-        self.repeat_requests: List[discord.User] = list()
-        self.stop_requests: List[discord.User] = list()
+        # IDs of the members listening to the session, kept up to date from voice state updates
+        self.listeners: Set[int] = set()
+        self._voice_channel_id: Optional[int] = None
+
+        # IDs of the listeners who voted for each action
+        self.skip_requests: Set[int] = set()
+        self.repeat_requests: Set[int] = set()
+        self.stop_requests: Set[int] = set()
 
         self.current_track = None
 
@@ -55,40 +72,68 @@ class Session:
         if request is not None:
             self.queue.add_request(request)
 
+        self._prefetching: Optional[Track] = None
+        self.queue.subscribe(self.prefetch)
+
         self.volume = self.config.get(
             'default_volume') or COG_CONFIG.DEFAULT_VOLUME
 
         self.is_playing = True
         self.play_next_song = asyncio.Event()
 
+        self._resume_position = 0
+        self._resumed: Optional[Dict] = None
+        if snapshot is not None:
+            self.restore(snapshot, resumed=resumed)
+
         asyncio.create_task(self.session_task(voice_channel))
 
     @property
     def current_track_play_time(self) -> int:
         return self.player.position // 1000
 
-    @property
-    def listeners(self) -> Generator[int, None, None]:
-        """Members listening to this session.
+    def time_until(self, index: int) -> int:
+        """Returns roughly how many seconds until the request at the given position in the queue starts playing."""
+        remaining = 0
+        if self.current_track is not None:
+            remaining = max(self.current_track.length - self.current_track_play_time, 0)
+        return remaining + self.queue.requests.length_before(index)
+
+    def _is_listening(self, user_id: int, state: discord.VoiceState) -> bool:
+        """Checks if a member is listening to this session.
 
         A member is classified as a listener if:
             - They are the not the bot
+            - They are in the bot's voice channel
             - They are not deafened
 
-        Returns:
-            `generator` of `int`: A generator consisting of the user_id's of members listening to the bot.
-
         """
-        if self.player.channel_id is None:
-            return
-
-        voice_channel = self.bot.get_channel(int(self.player.channel_id))
-        if voice_channel is None:
+        if user_id == self.bot.user.id or state.channel is None or state.channel.id != self._voice_channel_id:
+            return False
+        return not (state.deaf or state.self_deaf)
+
+    def reset_listeners(self, voice_channel: Optional[discord.VoiceChannel]):
+        """Rebuilds the set of listeners from the members in the voice channel the bot is in."""
+        self._voice_channel_id = voice_channel.id if voice_channel is not None else None
+        self.listeners = set()
+        if voice_channel is not None:
+            self.listeners = {user_id for user_id, state in voice_channel.voice_states.items() if self._is_listening(user_id, state)}
+
+        for votes in (self.skip_requests, self.repeat_requests, self.stop_requests):
+            votes &= self.listeners
+
+    def update_listener(self, member: discord.Member, state: discord.VoiceState):
+        """Updates the set of listeners from a member's new voice state, the votes of members who stop listening are removed."""
+        if member.id == self.bot.user.id:
+            self.reset_listeners(state.channel)
             return
 
-        for user_id, state in voice_channel.voice_states.items():
-            if user_id != self.bot.user.id and not (state.deaf or state.self_deaf):
-                yield user_id
+        if self._is_listening(member.id, state):
+            self.listeners.add(member.id)
+        else:
+            self.listeners.discard(member.id)
+            for votes in (self.skip_requests, self.repeat_requests, self.stop_requests):
+                votes.discard(member.id)
 
     def user_has_permission(self, user: discord.Member) -> bool:
         """Checks if a user has permission to interact with this session."""
@@ -100,6 +145,92 @@ class Session:
         """Changes this session's volume"""
         await self.player.set_volume(volume)
 
+    def snapshot(self) -> Optional[Dict]:
+        """Serializes the state of this session so it can be restored after a restart.
+
+        Returns:
+            `dict`: The session's state, or `None` if the session is not playing.
+
+        """
+        if not self.is_playing or self.current_track is None or self.player.channel_id is None:
+            return None
+
+        return {
+            'saved_at': time.time(),
+            'guild': self.guild.id,
+            'voice_channel': int(self.player.channel_id),
+            'log_channel': self.log_channel.id if self.log_channel is not None else None,
+            'run_forever': isinstance(self.queue, Radio),
+            'stoppable': self.stoppable,
+            'node': self.player.node.identifier if self.player.node is not None else None,
+            'volume': self.player.volume,
+            'paused': self.player.is_paused,
+            'position': self.player.position,
+            'current_track': self.current_track.to_dict(),
+            'requests': [track.to_dict() for track in self.queue.requests]
+        }
+
+    def _restore_track(self, data: Dict) -> Optional[Track]:
+        requester = None
+        if data.get('requester') is not None:
+            requester = self.guild.get_member(data['requester']) or self.bot.get_user(data['requester'])
+
+        try:
+            return Track.from_dict(data, requester)
+        except (KeyError, TypeError, OSError) as e:
+            self.bot.log.warning(f'Failed to restore track {data.get("url")!r} in {self.guild}: {type(e).__name__}: {e}')
+            return None
+
+    def restore(self, snapshot: Dict, *, resumed: bool = False):
+        """Restores the queue and volume of this session from a snapshot made by `snapshot`.
+
+        The track which was playing is played first, starting from where it was when the snapshot was made.
+
+        Kwargs:
+            resumed (bool): Determines wether the track is still loaded on a resumed Lavalink session,
+                if so the session takes over the track rather than playing it again.
+
+        """
+        self.volume = snapshot.get('volume') or self.volume
+
+        for data in snapshot.get('requests', list()):
+            track = self._restore_track(data)
+            if track is not None:
+                self.queue.add_request(track)
+
+        if snapshot.get('current_track') is not None:
+            track = self._restore_track(snapshot['current_track'])
+            if track is None:
+                return
+
+            self._resume_position = snapshot.get('position') or 0
+            if resumed:
+                self.current_track = track
+                self._resumed = snapshot
+            else:
+                self.queue.add_request(track, at_start=True)
+
+    def prefetch(self):
+        """Resolves the next track in the background so it can start playing without delay."""
+        if not self.is_playing or self.current_track is None:
+            return
+
+        track = self.queue.peek()
+        if track is None or track.track is not None or track is self._prefetching:
+            return
+
+        self._prefetching = track
+        asyncio.ensure_future(self._prefetch(track))
+
+    async def _prefetch(self, track: Track):
+        # Failures are retried when the track starts playing
+        with suppress(Exception):
+            await track.setup(self.bot)
+            self.queue.requests.refresh(track)
+
+        if self._prefetching is track:
+            self._prefetching = None
+
     async def toggle_next(self):
         """Sets the next track to start playing"""
         self.current_track = self.queue.next_track()
@@ -135,8 +266,44 @@ class Session:
             with suppress(discord.HTTPException):
                 await self.log_channel.send(**self.current_track.playing_message)
 
-        # Play the new track
-        await self.player.play(track)
+        # Play the new track, a restored track resumes from where it was left
+        start, self._resume_position = self._resume_position, 0
+        await self.player.play(track, start=start)
+
+        self.prefetch()
+
+    async def _reattach(self):
+        """Takes over the current track from the player of a resumed Lavalink session.
+
+        If Lavalink does not report the player's position the session was not resumed,
+        so the track is played again from where it was when the snapshot was made.
+        """
+        snapshot, self._resumed = self._resumed, None
+        current_track = self.current_track
+
+        # Audio stopped when the previous process left the voice channel, so the track continues from the snapshot's position
+        position, self._resume_position = self._resume_position, 0
+
+        self.player.current = await current_track.setup(self.bot)
+        self.player.paused = snapshot.get('paused', False)
+        self.player.last_position = position
+        self.player.last_update = last_update = time.time() * 1000
+
+        self.prefetch()
+
+        # Paused players are not reported
+        if self.player.paused:
+            return
+
+        await asyncio.sleep(RESUME_TIMEOUT)
+        if self.current_track is not current_track or self.player.last_update != last_update:
+            return
+
+        self.bot.log.warning(f'Lavalink did not resume the player in {self.guild}, playing {current_track._title!r} again.')
+        self._resume_position = int(self.player.position)
+        if self._resume_position:
+            self.queue.add_request(current_track, at_start=True)
+        await self.toggle_next()
 
     async def skip(self):
         """Skips the currently playing track"""
@@ -149,7 +316,7 @@ class Session:
 
     async def check_listeners(self):
         """Checks if there is anyone listening and pauses / resumes accordingly."""
-        if len(list(self.listeners)) > 0:
+        if self.listeners:
             if self.player.is_paused:
                 await self.player.set_pause(False)
                 self.not_alone.set()
@@ -162,10 +329,16 @@ class Session:
                 try:
                     await asyncio.wait_for(self.not_alone.wait(), self.timeout)
                 except asyncio.TimeoutError:
-                    self.stop()
+                    await self.stop()
 
     async def session_task(self, voice_channel):
         await self.player.connect(voice_channel.id)
+        self.reset_listeners(voice_channel)
         await self.player.set_volume(self.volume)
-        await self.toggle_next()
+
+        if self._resumed is not None:
+            asyncio.ensure_future(self._reattach())
+        else:
+            await self.toggle_next()
+
         await self.check_listeners()
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+import time
+
+from typing import Dict, List
+
+
+def _read(filename: str) -> Dict:
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return dict()
+
+
+def _write(filename: str, data: Dict):
+    # Write to a temporary file first so a crash mid-write cannot corrupt the previous snapshot
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, filename)
+
+
+async def load_snapshot(filename: str, *, max_age: float = None) -> Dict:
+    """Loads a snapshot saved by `save_snapshot`.
+
+    Args:
+        filename (str): The file the snapshot was saved to.
+
+    Kwargs:
+        max_age (float): How old in seconds the snapshot may be before it is ignored.
+
+    Returns:
+        `dict`: The snapshot's `saved_at` time, `sessions` and handed off Lavalink `resume_keys`.
+        The snapshot is empty if there is none or it is too old.
+
+    """
+    data = await asyncio.get_event_loop().run_in_executor(None, _read, filename)
+
+    if max_age is not None and data.get('saved_at', 0) + max_age < time.time():
+        data = dict()
+
+    return {
+        'saved_at': data.get('saved_at', 0),
+        'sessions': data.get('sessions', list()),
+        'resume_keys': data.get('resume_keys', dict())
+    }
+
+
+async def save_snapshot(filename: str, sessions: List[Dict], *, resume_keys: Dict[str, str] = None):
+    """Saves session snapshots to a JSON file, replacing its previous contents.
+
+    Kwargs:
+        resume_keys (dict): The resume keys of Lavalink sessions handed to the next process, by node identifier.
+
+    """
+    data = {
+        'saved_at': time.time(),
+        'sessions': sessions,
+        'resume_keys': resume_keys or dict()
+    }
+    await asyncio.get_event_loop().run_in_executor(None, _write, filename, data)
@@ -0,0 +1,246 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import secrets
+import time
+
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+import discord
+from discord.ext import commands
+
+from bot.config import config as BOT_CONFIG
+
+# Gateway events the player reacts to
+GATEWAY_EVENTS = ('GUILD_CREATE', 'VOICE_STATE_UPDATE', 'MESSAGE_CREATE', 'MESSAGE_REACTION_ADD')
+
+# Lavalink event fields kept, other than the guild
+LAVALINK_EVENT_FIELDS = ('type', 'reason', 'thresholdMs', 'error', 'code')
+
+# URL path segments which describe the kind of resource rather than identify it
+URL_KEYWORDS = ('watch', 'playlist', 'sets', 'embed', 'v')
+
+TRACE_VERSION = 1
+
+
+class Anonymizer:
+    """Replaces identifying values with consistent stand-ins.
+
+    IDs are renumbered in the order they are first seen and text is replaced by a salted hash,
+    the same value is always replaced by the same stand-in within a trace.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, str] = dict()
+        self._salt = secrets.token_bytes(16)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def id(self, value) -> Optional[str]:
+        if value is None:
+            return None
+        value = str(value)
+        if value not in self._ids:
+            self._ids[value] = str(len(self._ids) + 1)
+        return self._ids[value]
+
+    def text(self, value: str, length: int = 8) -> str:
+        return hashlib.sha1(self._salt + value.encode()).hexdigest()[:length]
+
+    def url(self, value: str) -> str:
+        """Anonymizes a URL, keeping its host, structure and the length of each part so it is still recognised."""
+        url = urlsplit(value)
+        path = '/'.join(part if not part or part in URL_KEYWORDS else self.text(part, len(part)) for part in url.path.split('/'))
+        query = '&'.join(f'{key}={self.text(part, len(part))}' for key, part in parse_qsl(url.query))
+        return urlunsplit((url.scheme, url.netloc, path, query, ''))
+
+    def argument(self, value: str) -> str:
+        """Anonymizes a command argument, numbers are kept."""
+        try:
+            float(value)
+        except ValueError:
+            pass
+        else:
+            return value
+
+        if value.startswith(('http://', 'https://')):
+            return self.url(value)
+        return self.text(value)
+
+
+class TraceRecorder:
+    """Records anonymized gateway and Lavalink events to a compressed JSON lines file, see `bot.testing.replay`.
+
+    Only the events and fields the player uses are kept, events caused by the bot itself are skipped.
+    Each line is a list of the milliseconds since recording started, the event's source (`g` or `l`), its name and its data.
+
+    Once a trace's anonymizer has seen `max_ids` IDs a new trace file is started with a new anonymizer,
+    so the IDs remembered stay bounded however long the bot runs.
+    Each new file starts with the voice states of every guild so it can be replayed on its own.
+
+    Args:
+        bot (discord.Client): The bot to record events for.
+        directory (str): The directory to write traces to, each recorder writes new files.
+
+    Kwargs:
+        max_ids (int): How many IDs to anonymize before starting a new trace file.
+
+    """
+
+    def __init__(self, bot: discord.Client, directory: str, *, max_ids: int = 100000):
+        self.bot = bot
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_ids = max_ids
+
+        self._files = itertools.count()
+        self._pending: List[str] = list()
+        self._start_file()
+
+    def _start_file(self):
+        self.filename = self.directory / f'trace-{datetime.datetime.utcnow():%Y%m%d-%H%M%S}-{next(self._files)}.jsonl.gz'
+        self._anonymizer = Anonymizer()
+        self._started = time.monotonic()
+        self._header_written = False
+
+    def _record(self, source: str, name: str, data: Dict):
+        if not self._header_written:
+            self._pending.append(json.dumps({'version': TRACE_VERSION, 'user': self._anonymizer.id(self.bot.user.id)}))
+            self._header_written = True
+
+        elapsed = int((time.monotonic() - self._started) * 1000)
+        self._pending.append(json.dumps([elapsed, source, name, data], separators=(',', ':')))
+
+    def gateway(self, message: Dict):
+        """Records a gateway message, as dispatched by `on_socket_response`."""
+        name, data = message.get('t'), message.get('d')
+        if name not in GATEWAY_EVENTS or not isinstance(data, dict) or self.bot.user is None:
+            return
+
+        user_id = str(self.bot.user.id)
+        anonymize = self._anonymizer
+
+        if name == 'GUILD_CREATE':
+            self._record('g', name, {
+                'id': anonymize.id(data['id']),
+                'channels': [{'id': anonymize.id(channel['id']), 'type': channel['type']} for channel in data.get('channels', ())],
+                'voice_states': [
+                    {'user_id': anonymize.id(state['user_id']), 'channel_id': anonymize.id(state['channel_id']), 'self_deaf': state.get('self_deaf', False)}
+                    for state in data.get('voice_states', ()) if state['user_id'] != user_id
+                ]
+            })
+
+        elif name == 'VOICE_STATE_UPDATE':
+            if data['user_id'] == user_id or data.get('guild_id') is None:
+                return
+            self._record('g', name, {
+                'guild_id': anonymize.id(data['guild_id']),
+                'channel_id': anonymize.id(data.get('channel_id')),
+                'user_id': anonymize.id(data['user_id']),
+                'self_deaf': data.get('self_deaf', False) or data.get('deaf', False)
+            })
+
+        elif name == 'MESSAGE_CREATE':
+            if data['author']['id'] == user_id or data.get('guild_id') is None:
+                return
+            content = self._content(data.get('content', ''))
+            if content is None:
+                return
+            self._record('g', name, {
+                'guild_id': anonymize.id(data['guild_id']),
+                'channel_id': anonymize.id(data['channel_id']),
+                'author_id': anonymize.id(data['author']['id']),
+                'content': content
+            })
+
+        elif name == 'MESSAGE_REACTION_ADD':
+            if data['user_id'] == user_id or data.get('guild_id') is None:
+                return
+            emoji = data['emoji']
+            self._record('g', name, {
+                'guild_id': anonymize.id(data['guild_id']),
+                'channel_id': anonymize.id(data['channel_id']),
+                'message_id': anonymize.id(data['message_id']),
+                'user_id': anonymize.id(data['user_id']),
+                'emoji': emoji['name'] if emoji.get('id') is None else anonymize.text(emoji['name'] or '')
+            })
+
+    def _record_voice_states(self):
+        """Records the members in each guild's voice channels as the guild's `GUILD_CREATE`."""
+        for guild in self.bot.guilds:
+            channels = [channel for channel in guild.voice_channels if channel.voice_states]
+            if not channels:
+                continue
+            self.gateway({'t': 'GUILD_CREATE', 'd': {
+                'id': str(guild.id),
+                'channels': [{'id': str(channel.id), 'type': channel.type.value} for channel in channels],
+                'voice_states': [
+                    {'user_id': str(user_id), 'channel_id': str(channel.id), 'self_deaf': state.self_deaf or state.deaf}
+                    for channel in channels for user_id, state in channel.voice_states.items()
+                ]
+            }})
+
+    def _content(self, content: str) -> Optional[str]:
+        """Anonymizes a command's arguments, keeping its prefix and the names of the command and its subcommands.
+
+        Returns:
+            `str`: The anonymized command, or `None` if the message is not a command.
+
+        """
+        prefix = next((prefix for prefix in BOT_CONFIG.PREFIXES if content.startswith(prefix)), None)
+        if prefix is None:
+            return None
+
+        words = content[len(prefix):].split()
+        command = self.bot.get_command(words[0]) if words else None
+        if command is None:
+            return None
+
+        names, arguments = words[:1], words[1:]
+        while isinstance(command, commands.Group) and arguments and command.get_command(arguments[0]) is not None:
+            command = command.get_command(arguments[0])
+            names.append(arguments.pop(0))
+
+        return prefix + ' '.join(names + [self._anonymizer.argument(argument) for argument in arguments])
+
+    def lavalink(self, data: Dict):
+        """Records a message received from Lavalink, only player events are kept."""
+        if data.get('op') != 'event':
+            return
+
+        event = {key: value for key, value in data.items() if key in LAVALINK_EVENT_FIELDS}
+        event['guildId'] = self._anonymizer.id(data.get('guildId'))
+        self._record('l', data['type'], event)
+
+    @staticmethod
+    def _append(filename: Path, lines: List[str]):
+        # Each flush appends a new gzip member, readers see a single stream
+        with gzip.open(filename, 'at', encoding='UTF-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    async def flush(self):
+        """Writes the events recorded since the last flush, starting a new trace file afterwards if the current one has seen `max_ids` IDs."""
+        filename, lines, self._pending = self.filename, self._pending, list()
+        if len(self._anonymizer) >= self.max_ids:
+            self._start_file()
+            self._record_voice_states()
+
+        if lines:
+            await asyncio.get_event_loop().run_in_executor(None, self._append, filename, lines)
+
+
+def read_trace(filename: str) -> List:
+    """Reads a trace written by `TraceRecorder`.
+
+    Returns:
+        `list`: The trace's header followed by its events.
+
+    """
+    with gzip.open(filename, 'rt', encoding='UTF-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
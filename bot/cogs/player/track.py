@@ -2,9 +2,9 @@ import asyncio
 import re
 
 # from functools import partial
+from concurrent.futures import Executor
 from pathlib import Path
-from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 # import aiohttp
 import wavelink
@@ -12,11 +12,11 @@ import wavelink
 import discord
 from discord.ext import commands
 
-from fuzzywuzzy import fuzz
-from mutagen.mp3 import MP3
-
 from bot.utils import tools
 
+from .library import Library, MetadataCache, TrackMetadata, read_cover
+from .search import SearchIndex, SearchWorker, tokenize
+
 from bot.config import config as BOT_CONFIG
 COG_CONFIG = BOT_CONFIG.EXTENSIONS[__name__[:__name__.rindex('.')]]
 
@@ -34,7 +34,7 @@ class Track:
     async def setup(self, bot) -> wavelink.Track:
         """Prepares a wavelink track object for playing."""
         if self.track is None:
-            data = await bot._wavelink.get_tracks(self.url)
+            data = await bot._track_resolver.get_tracks(self.url)
 
             if not data:
                 raise commands.BadArgument('Error loading track.')
@@ -43,6 +43,41 @@ class Track:
 
         return self.track
 
+    def to_dict(self) -> Dict:
+        """Serializes the track so it can be restored by `Track.from_dict`.
+
+        The resolved Lavalink track is included so restoring it does not need another lookup.
+        """
+        return {
+            'type': type(self).__name__,
+            'url': self.url,
+            'requester': self.requester.id if self.requester is not None else None,
+            'track': [self.track.id, self.track.info] if self.track is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, requester: discord.User = None) -> 'Track':
+        """Restores a track serialized by `to_dict`.
+
+        Args:
+            data (dict): The serialized track.
+            requester (discord.User): The user who requested the track.
+
+        """
+        track = wavelink.Track(*data['track']) if data.get('track') else None
+        return TRACK_TYPES[data['type']]._from_dict(data, requester, track)
+
+    @classmethod
+    def _from_dict(cls, data: Dict, requester: Optional[discord.User], track: Optional[wavelink.Track]) -> 'Track':
+        return cls(data['url'], requester, track)
+
+    @property
+    def identifier(self) -> str:
+        """Identifies what is played, the same track requested twice has the same identifier."""
+        if self.track is not None:
+            return self.track.info['identifier']
+        return self.url
+
     @property
     def length(self) -> int:
         if self.track is not None:
@@ -138,44 +173,49 @@ class MP3Track(Track):
     _embed_colour = discord.Colour.dark_green()
     _track_type = 'MP3 file'
     _search_ready = asyncio.Event()
-    _tracks: Dict[Path, str] = dict()
+    _index = SearchIndex(min_ratio=COG_CONFIG.SEARCH_MIN_RATIO)
+    _search_worker: Optional[SearchWorker] = None
+    _library = Library.get(COG_CONFIG.DEFAULT_PLAYLIST_DIRECTORY)
+    _metadata_cache = MetadataCache(COG_CONFIG.METADATA_CACHE_SIZE)
 
     def __init__(self, filename: str, requester: discord.User = None, track: wavelink.Track = None, **kwargs):
         super().__init__(COG_CONFIG.MP3_BASE_URL + filename, requester, track)
-        self.metadata = dict()
+        self.filename = filename
+        # Library tracks are kept up to date by the library, only other files are read here
+        self.metadata = Library.lookup(Path(filename)) or self._metadata_cache.get(Path(filename))
 
-        # Populate metadata
-        tags = MP3(filename)
+    def to_dict(self) -> Dict:
+        return dict(super().to_dict(), filename=self.filename)
 
-        for attribute, tag in (('title', 'TIT2'), ('artist', 'TPE1'), ('album', 'TALB'), ('date', 'TDRC')):
-            data = tags.get(tag)
-            if data is not None:
-                self.metadata[attribute] = data[0]
+    @classmethod
+    def _from_dict(cls, data: Dict, requester: Optional[discord.User], track: Optional[wavelink.Track]) -> 'Track':
+        return cls(data['filename'], requester, track)
 
-        for attribute, tag in (('cover', 'APIC:'), ('cover', 'APIC')):
-            data = tags.get(tag)
-            if data is not None:
-                self.metadata[attribute] = BytesIO(data.data)
+    @property
+    def length(self) -> int:
+        if self.metadata.length:
+            return int(self.metadata.length)
+        return super().length
 
     @property
     def _title(self):
-        return self.metadata.get('title', 'Unknown')
+        return self.metadata.title or 'Unknown'
 
     @property
     def _album(self):
-        return self.metadata.get('album', 'Unknown')
+        return self.metadata.album or 'Unknown'
 
     @property
     def _author(self):
-        return self.metadata.get('artist', 'Unknown')
+        return self.metadata.artist or 'Unknown'
 
     @property
     def _date(self):
-        return self.metadata.get('date', 'Unknown')
+        return self.metadata.date or 'Unknown'
 
     @property
     def _cover(self):
-        return self.metadata.get('cover', open(COG_CONFIG.DEFAULT_ALBUM_ARTWORK, 'rb'))
+        return read_cover(self.metadata) or open(COG_CONFIG.DEFAULT_ALBUM_ARTWORK, 'rb')
 
     # endregion
 
@@ -185,7 +225,6 @@ class MP3Track(Track):
 
     @property
     def playing_message(self) -> Dict:
-        self._cover.seek(0)
         return {
             'embed': discord.Embed(
                 colour=discord.Colour.dark_green(),
@@ -205,29 +244,55 @@ class MP3Track(Track):
         await cls._search_ready.wait()
 
         # Search through all tracks
-        scores = {t: 0.0 for t in cls._tracks}
-        for word in re.sub(r'[^\w\s]', '', argument).split():
-            for track in cls._tracks:
-                for _word in cls._tracks[track]:
-                    scores[track] += fuzz.ratio(word.lower(), _word.lower())
-
-        for track in cls._tracks:
-            scores[track] /= len(cls._tracks[track])
-        search_results = sorted(scores, key=scores.get, reverse=True)
+        if cls._search_worker is not None:
+            try:
+                search_results = await cls._search_worker.search(argument, COG_CONFIG.MAX_SEARCH_RESULTS)
+            except RuntimeError:
+                raise commands.BadArgument('Local track search is currently unavailable.')
+        else:
+            search_results = cls._index.search(argument, COG_CONFIG.MAX_SEARCH_RESULTS)
 
         # Raise error or pick search result
-        tracks = [cls(str(track), requester=ctx.author) for track in search_results[:COG_CONFIG.MAX_SEARCH_RESULTS]]
+        tracks = [cls(str(track), requester=ctx.author) for track in search_results]
         result = await cls.get_user_choice(ctx, argument, [(track._title, track._album) for track in tracks])
 
         return tracks[result]
 
     @classmethod
-    def setup_search(cls):
-        for track in Path(COG_CONFIG.DEFAULT_PLAYLIST_DIRECTORY).absolute().glob('**/*.mp3'):
-            tags = MP3(str(track))
-            cls._tracks[track] = re.sub(r'[^\w\s]', '', tags.get('TIT2')[0] + ' ' + tags.get('TALB')[0]).split(' ')
+    def _update_index(cls, path: Path, metadata: Optional[TrackMetadata]):
+        if cls._search_worker is not None:
+            if cls._search_worker.running:
+                if metadata is None:
+                    cls._search_worker.remove(path)
+                else:
+                    cls._search_worker.add(path, tokenize(f'{metadata.title or ""} {metadata.album or ""}'))
+            return
+
+        if metadata is None:
+            cls._index.remove(path)
+        else:
+            cls._index.add(path, tokenize(f'{metadata.title or ""} {metadata.album or ""}'))
+
+    @classmethod
+    async def setup_search(cls, executor: Executor = None, progress: Callable[[int, int], None] = None):
+        """Indexes the default playlist directory.
+
+        Searches are available as soon as the cached part of the library has been indexed,
+        the remaining files are indexed as they are read.
+
+        If `SEARCH_WORKER` is enabled the index is kept in a separate process.
+        """
+        if COG_CONFIG.SEARCH_WORKER:
+            cls._search_worker = SearchWorker(min_ratio=COG_CONFIG.SEARCH_MIN_RATIO)
+            await cls._search_worker.start()
 
-        cls._search_ready.set()
+        def on_progress(done: int, total: int):
+            cls._search_ready.set()
+            if progress is not None:
+                progress(done, total)
+
+        cls._library.subscribe(cls._update_index)
+        await cls._library.scan(COG_CONFIG.LIBRARY_CACHE, executor=executor, progress=on_progress)
 
 
 class StreamableTrack(Track):
@@ -264,7 +329,7 @@ class StreamableTrack(Track):
     async def convert(cls, ctx: commands.Converter, argument: str):
         async with ctx.typing():
 
-            tracks = await ctx.bot._wavelink.get_tracks(cls._search_type + argument)
+            tracks = await ctx.bot._track_resolver.get_tracks(cls._search_type + argument)
             if not isinstance(tracks, list):
                 raise commands.BadArgument('No search results were found.')
 
@@ -335,3 +400,73 @@ class AttachmentTrack(StreamableTrack):
     @classmethod
     async def convert(cls, ctx: commands.Context, argument: str):
         raise NotImplementedError
+
+
+TRACK_TYPES: Dict[str, type] = {
+    track_type.__name__: track_type for track_type in (Track, MP3Track, YouTubeTrack, SoundCloudTrack, AttachmentTrack)
+}
+
+
+class Playlist:
+    """A YouTube or SoundCloud playlist request.
+
+    The playlist's first track is resolved on its own when possible,
+    so it can start playing before the rest of the playlist has loaded.
+    """
+    youtube_playlist_check = re.compile(r'youtu(?:be(?:-nocookie)?\.com|\.be)\/\S*?[?&]list=([a-zA-Z0-9_-]+)')
+    soundcloud_playlist_check = re.compile(r'soundcloud\.com\/[^\/\s]+\/sets\/')
+
+    def __init__(self, url: str, requester: discord.User, track_type: type):
+        self.url = url
+        self.requester = requester
+        self.track_type = track_type
+
+        self.name = 'Unknown playlist'
+        self.first: Optional[Track] = None
+        self.tracks: Optional[List[Track]] = None
+
+    async def load(self, bot) -> List[Track]:
+        """Loads every track in the playlist."""
+        if self.tracks is None:
+            data = await bot._track_resolver.get_tracks(self.url)
+
+            if not isinstance(data, wavelink.TrackPlaylist) or not data.tracks:
+                raise commands.BadArgument('Error loading playlist.')
+
+            self.name = data.data.get('playlistInfo', {}).get('name') or self.name
+            self.tracks = [self.track_type(track.info['uri'], self.requester, track) for track in data.tracks]
+
+        return self.tracks
+
+    @property
+    def remaining(self) -> List[Track]:
+        """The tracks of the loaded playlist other than the first."""
+        tracks = list(self.tracks or [])
+
+        if self.first is not None:
+            identifiers = [track.track.info['identifier'] for track in tracks]
+            if self.first.track.info['identifier'] in identifiers:
+                del tracks[identifiers.index(self.first.track.info['identifier'])]
+
+        return tracks
+
+    @classmethod
+    async def convert(cls, ctx: commands.Context, argument: str):
+        if cls.soundcloud_playlist_check.search(argument) is not None:
+            playlist = cls(argument, ctx.author, SoundCloudTrack)
+        elif cls.youtube_playlist_check.search(argument) is not None:
+            playlist = cls(argument, ctx.author, YouTubeTrack)
+        else:
+            raise commands.BadArgument('That is not a YouTube or SoundCloud playlist.')
+
+        async with ctx.typing():
+
+            # If a video was selected resolve it without waiting for the playlist
+            video = YouTubeTrack.video_url_check.search(argument)
+            if playlist.track_type is YouTubeTrack and video is not None:
+                playlist.first = YouTubeTrack(f'https://youtu.be/{video.group(1)}', ctx.author)
+                await playlist.first.setup(ctx.bot)
+            else:
+                playlist.first = (await playlist.load(ctx.bot))[0]
+
+        return playlist
@@ -0,0 +1,283 @@
+from collections import Counter
+from random import random
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import discord
+
+from .track import Track
+
+
+class _Node:
+    __slots__ = ('track', 'tag', 'requester', 'identifier', 'length', 'priority', 'parent', 'left', 'right', 'size', 'total')
+
+    def __init__(self, track: Track, tag: float):
+        self.track = track
+        self.tag = tag
+        # Keys are kept so counts stay right if the track changes while queued
+        self.requester = track.requester.id if track.requester is not None else None
+        self.identifier = track.identifier
+        self.length = track.length
+        self.priority = random()
+        self.parent: Optional[_Node] = None
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.size = 1
+        self.total = self.length
+
+    def update(self):
+        self.size = 1 + _size(self.left) + _size(self.right)
+        self.total = self.length + _total(self.left) + _total(self.right)
+        for child in (self.left, self.right):
+            if child is not None:
+                child.parent = self
+
+    def rank(self) -> int:
+        """Returns the node's position in its tree."""
+        rank = _size(self.left)
+        node = self
+        while node.parent is not None:
+            if node is node.parent.right:
+                rank += _size(node.parent.left) + 1
+            node = node.parent
+        return rank
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _total(node: Optional[_Node]) -> int:
+    return node.total if node is not None else 0
+
+
+def _split(node: Optional[_Node], index: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Splits a tree into its first `index` nodes and the rest."""
+    if node is None:
+        return None, None
+
+    if _size(node.left) < index:
+        node.right, right = _split(node.right, index - _size(node.left) - 1)
+        node.update()
+        return node, right
+
+    left, node.left = _split(node.left, index)
+    node.update()
+    return left, node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Joins two trees, every node of `left` comes before those of `right`."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+class TrackList:
+    """A sequence of tracks supporting fast positional inserts and removals.
+
+    Tracks are kept in a tree ordered by position, so inserting, removing or looking up a track at any position takes O(log n) time.
+    The tracks each user requested, the number of times each track is in the list and the total length of every track in the list
+    are kept up to date as tracks are added and removed.
+
+    Each track has a tag, used by `insort` to order tracks, see `Queue`.
+    """
+
+    def __init__(self, tracks: List[Track] = ()):
+        self._root: Optional[_Node] = None
+        self._requesters: Dict[Optional[int], Set[_Node]] = dict()
+        self._identifiers: Counter = Counter()
+
+        for track in tracks:
+            self.append(track)
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __iter__(self) -> Iterator[Track]:
+        return self.islice(0)
+
+    def __getitem__(self, index: int) -> Track:
+        return self._node(index).track
+
+    @property
+    def length(self) -> int:
+        """The total length of every track in seconds."""
+        return _total(self._root)
+
+    def __repr__(self) -> str:
+        return f'<TrackList length={len(self)}>'
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('TrackList index out of range')
+        return index
+
+    def _node(self, index: int) -> _Node:
+        index = self._index(index)
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index > left:
+                index -= left + 1
+                node = node.right
+            else:
+                return node
+
+    def islice(self, start: int, stop: int = None) -> Iterator[Track]:
+        """Iterates over the tracks from position `start` up to `stop`, taking O(log n) time to find the first track."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+
+        # Descend to the first track, remembering the nodes which come after it
+        stack, node, index = [], self._root, start
+        while node is not None:
+            left = _size(node.left)
+            if index < left:
+                stack.append(node)
+                node = node.left
+            elif index > left:
+                index -= left + 1
+                node = node.right
+            else:
+                stack.append(node)
+                break
+
+        for _ in range(stop - start):
+            node = stack.pop()
+            yield node.track
+
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def length_before(self, index: int) -> int:
+        """Returns the total length in seconds of the tracks before the given position, in O(log n) time."""
+        length, node = 0, self._root
+        while node is not None:
+            if index <= _size(node.left):
+                node = node.left
+            else:
+                length += _total(node.left) + node.length
+                index -= _size(node.left) + 1
+                node = node.right
+        return length
+
+    def tag(self, index: int) -> float:
+        """Returns the tag of the track at the given position."""
+        return self._node(index).tag
+
+    def insert(self, index: int, track: Track, *, tag: float = 0.0) -> int:
+        """Inserts a track before the given position.
+
+        Returns:
+            `int`: The position the track was inserted at.
+
+        """
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))
+
+        node = _Node(track, tag)
+        self._requesters.setdefault(node.requester, set()).add(node)
+        self._identifiers[node.identifier] += 1
+
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, node), right)
+        self._root.parent = None
+        return index
+
+    def insort(self, track: Track, tag: float) -> int:
+        """Inserts a track after every track with a lower or equal tag, the list must be ordered by tag.
+
+        Returns:
+            `int`: The position the track was inserted at.
+
+        """
+        index, node = 0, self._root
+        while node is not None:
+            if tag < node.tag:
+                node = node.left
+            else:
+                index += _size(node.left) + 1
+                node = node.right
+
+        return self.insert(index, track, tag=tag)
+
+    def append(self, track: Track, *, tag: float = 0.0) -> int:
+        return self.insert(len(self), track, tag=tag)
+
+    def appendleft(self, track: Track, *, tag: float = 0.0) -> int:
+        return self.insert(0, track, tag=tag)
+
+    def refresh(self, track: Track):
+        """Updates the length of a track which has changed while in the list, such as once it has been resolved."""
+        requester = track.requester.id if track.requester is not None else None
+        for node in self._requesters.get(requester, ()):
+            if node.track is track and node.length != track.length:
+                node.length = track.length
+                while node is not None:
+                    node.update()
+                    node = node.parent
+
+    def pop(self, index: int = -1) -> Track:
+        """Removes and returns the track at the given position."""
+        index = self._index(index)
+
+        left, right = _split(self._root, index)
+        node, right = _split(right, 1)
+        self._root = _merge(left, right)
+        if self._root is not None:
+            self._root.parent = None
+
+        self._requesters[node.requester].discard(node)
+        if not self._requesters[node.requester]:
+            del self._requesters[node.requester]
+        self._identifiers[node.identifier] -= 1
+        if not self._identifiers[node.identifier]:
+            del self._identifiers[node.identifier]
+
+        return node.track
+
+    def popleft(self) -> Track:
+        return self.pop(0)
+
+    def clear(self):
+        self._root = None
+        self._requesters.clear()
+        self._identifiers.clear()
+
+    def requested_by(self, user: discord.abc.User) -> int:
+        """Returns the number of tracks requested by a user."""
+        return len(self._requesters.get(user.id, ()))
+
+    def first_requested_by(self, user: discord.abc.User) -> Optional[int]:
+        """Returns the position of the first track requested by a user, in O(k log n) time for a user with k tracks."""
+        nodes = self._requesters.get(user.id)
+        if not nodes:
+            return None
+        return min(node.rank() for node in nodes)
+
+    def last_tag_requested_by(self, requester: Optional[int]) -> Optional[float]:
+        """Returns the highest tag of the tracks requested by the user with the given ID, or `None` if they have no tracks in the list."""
+        nodes = self._requesters.get(requester)
+        if not nodes:
+            return None
+        return max(node.tag for node in nodes)
+
+    def contains(self, track: Track) -> bool:
+        """Returns whether the same track is already in the list, even if it was requested separately."""
+        return track.identifier in self._identifiers
@@ -0,0 +1,228 @@
+import asyncio
+import datetime
+import json
+import time
+
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import discord
+from discord.ext import commands
+
+DISCORD_EPOCH = 1420070400000
+
+
+def user_payload(user_id: int, name: str, *, bot: bool = False) -> Dict:
+    return {'id': str(user_id), 'username': name, 'discriminator': f'{user_id % 10000:04}', 'avatar': None, 'bot': bot}
+
+
+def member_payload(user: Dict) -> Dict:
+    return {'user': user, 'roles': [], 'joined_at': None, 'deaf': False, 'mute': False}
+
+
+class FakeDiscord:
+    """Stands in for the Discord gateway and HTTP API so a bot can run without connecting to Discord.
+
+    Gateway events are fed straight into the bot's connection state as if they had been received,
+    HTTP requests are answered locally and messages the bot sends are echoed back as gateway events.
+
+    Args:
+        bot (commands.Bot): The bot to connect, it must not be logged in.
+
+    Kwargs:
+        user_id (int): The bot user's ID.
+        latency (float): The delay in seconds before each HTTP request is answered.
+
+    """
+
+    def __init__(self, bot: commands.Bot, *, user_id: int = 1, latency: float = 0.0):
+        self.bot = bot
+        self.latency = latency
+        self.user = user_payload(user_id, bot.__class__.__name__, bot=True)
+
+        self.http_calls: Counter = Counter()
+        self.gateway_calls: Counter = Counter()
+        self._last_id = 0
+        self._message_hooks: List[Callable[[Dict], None]] = list()
+
+    def start(self):
+        """Logs the bot in, it is ready once this returns."""
+        state = self.bot._connection
+        state.user = discord.ClientUser(state=state, data=self.user)
+
+        self.bot.http.request = self.request
+        self.bot.ws = self
+        self.bot._ready.set()
+
+    def snowflake(self) -> int:
+        """Generates a new unique ID."""
+        self._last_id = max((int(time.time() * 1000) - DISCORD_EPOCH) << 22, self._last_id + 1)
+        return self._last_id
+
+    def on_message_sent(self, callback: Callable[[Dict], None]):
+        """Registers a callback to be called with each message the bot sends."""
+        self._message_hooks.append(callback)
+
+    def receive(self, event: str, data: Dict):
+        """Dispatches a gateway event to the bot."""
+        self.bot.dispatch('socket_response', {'op': 0, 't': event, 'd': data})
+        self.bot._connection.parsers[event](data)
+
+    # region gateway events
+
+    @staticmethod
+    def channel_payload(channel_id: int, voice: bool, position: int = 0) -> Dict:
+        if voice:
+            return {'id': str(channel_id), 'type': 2, 'name': f'voice-{position}', 'position': position, 'bitrate': 64000, 'user_limit': 0,
+                    'permission_overwrites': []}
+        return {'id': str(channel_id), 'type': 0, 'name': f'text-{position}', 'position': position, 'topic': None, 'nsfw': False,
+                'permission_overwrites': []}
+
+    def create_guild(self, name: str, members: List[Dict], *, voice_channels: int = 1, text_channels: int = 1) -> Dict:
+        """Creates a guild containing the given members and the bot.
+
+        Returns:
+            `dict`: The guild's payload.
+
+        """
+        channels = [self.channel_payload(self.snowflake(), True, index) for index in range(voice_channels)]
+        channels += [self.channel_payload(self.snowflake(), False, index) for index in range(text_channels)]
+        return self.guild_create(self.snowflake(), name, members, channels)
+
+    def guild_create(self, guild_id: int, name: str, members: List[Dict], channels: List[Dict], *, voice_states: List[Dict] = None) -> Dict:
+        """Makes a guild available to the bot, its members and voice states are given as user and voice state payloads.
+
+        Returns:
+            `dict`: The guild's payload.
+
+        """
+        data = {
+            'id': str(guild_id),
+            'name': name,
+            'owner_id': self.user['id'],
+            'member_count': len(members) + 1,
+            'large': False,
+            'features': [],
+            'emojis': [],
+            'roles': [{
+                'id': str(guild_id), 'name': '@everyone', 'permissions': str(discord.Permissions.all().value), 'position': 0,
+                'color': 0, 'hoist': False, 'managed': False, 'mentionable': False
+            }],
+            'channels': channels,
+            'members': [member_payload(self.user)] + [member_payload(user) for user in members],
+            'voice_states': voice_states or []
+        }
+
+        self.receive('GUILD_CREATE', data)
+        return data
+
+    def channel_create(self, guild_id: int, channel_id: int, voice: bool) -> Dict:
+        """Creates a channel in a guild."""
+        data = self.channel_payload(channel_id, voice, len(self.bot.get_guild(guild_id).channels))
+        data['guild_id'] = str(guild_id)
+        self.receive('CHANNEL_CREATE', data)
+        return data
+
+    def voice_state_update(self, guild_id: int, channel_id: Optional[int], user: Dict, *, deaf: bool = False):
+        """Moves a user into a voice channel, or out of voice if `channel_id` is `None`."""
+        self.receive('VOICE_STATE_UPDATE', self.voice_state_payload(guild_id, channel_id, user, deaf=deaf))
+
+    @staticmethod
+    def voice_state_payload(guild_id: int, channel_id: Optional[int], user: Dict, *, deaf: bool = False) -> Dict:
+        return {
+            'guild_id': str(guild_id),
+            'channel_id': str(channel_id) if channel_id is not None else None,
+            'user_id': user['id'],
+            'session_id': f'session-{user["id"]}',
+            'deaf': False,
+            'mute': False,
+            'self_deaf': deaf,
+            'self_mute': False,
+            'self_video': False,
+            'suppress': False,
+            'member': member_payload(user)
+        }
+
+    def message_payload(self, guild_id: int, channel_id: int, author: Dict, content: str = '', *, embeds: List[Dict] = None) -> Dict:
+        return {
+            'id': str(self.snowflake()),
+            'type': 0,
+            'guild_id': str(guild_id),
+            'channel_id': str(channel_id),
+            'author': author,
+            'member': member_payload(author),
+            'content': content,
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': embeds or [],
+            'pinned': False
+        }
+
+    def message_create(self, guild_id: int, channel_id: int, author: Dict, content: str) -> Dict:
+        """Sends a message as a user."""
+        data = self.message_payload(guild_id, channel_id, author, content)
+        self.receive('MESSAGE_CREATE', data)
+        return data
+
+    def reaction_add(self, guild_id: int, channel_id: int, message_id: int, user: Dict, emoji: str):
+        """Reacts to a message as a user."""
+        self.receive('MESSAGE_REACTION_ADD', {
+            'guild_id': str(guild_id),
+            'channel_id': str(channel_id),
+            'message_id': str(message_id),
+            'user_id': user['id'],
+            'member': member_payload(user),
+            'emoji': {'id': None, 'name': emoji}
+        })
+
+    # endregion
+
+    # region gateway commands
+
+    async def voice_state(self, guild_id: int, channel_id: Optional[int], self_mute: bool = False, self_deaf: bool = False):
+        """Connects the bot to voice, Discord answers with the bot's voice state and a voice server."""
+        self.gateway_calls['voice_state'] += 1
+        self.voice_state_update(guild_id, int(channel_id) if channel_id is not None else None, self.user, deaf=self_deaf)
+
+        if channel_id is not None:
+            self.receive('VOICE_SERVER_UPDATE', {'token': 'token', 'guild_id': str(guild_id), 'endpoint': 'localhost'})
+
+    async def change_presence(self, *, activity=None, status=None, afk=False, since=0.0):
+        self.gateway_calls['change_presence'] += 1
+
+    # endregion
+
+    async def request(self, route: discord.http.Route, *, files=None, form=None, **kwargs):
+        """Answers an HTTP request made by the bot."""
+        self.http_calls[f'{route.method} {route.path}'] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        payload = kwargs.get('json') or dict()
+        for field in form or ():
+            if field['name'] == 'payload_json':
+                payload = json.loads(field['value'])
+
+        if route.path in ('/channels/{channel_id}/messages', '/channels/{channel_id}/messages/{message_id}') and route.method in ('POST', 'PATCH'):
+            embeds = payload.get('embeds') or ([payload['embed']] if payload.get('embed') else [])
+            channel_id = int(route.channel_id)
+            channel = self.bot.get_channel(channel_id)
+            guild_id = channel.guild.id if channel is not None else 0
+
+            data = self.message_payload(guild_id, channel_id, self.user, payload.get('content') or '', embeds=embeds)
+            if route.method == 'PATCH':
+                data['id'] = route.url.rsplit('/', 1)[-1]
+                return data
+
+            self.receive('MESSAGE_CREATE', data)
+            for callback in self._message_hooks:
+                callback(data)
+            return data
+
+        return None
@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+
+from collections import Counter
+from typing import Dict, Optional, Set, Tuple
+
+from aiohttp import web, WSMsgType
+
+
+def encode_track(info: Dict) -> str:
+    """Encodes a track's info into an opaque identifier, the way Lavalink encodes tracks."""
+    return base64.b64encode(json.dumps(info, separators=(',', ':')).encode()).decode()
+
+
+def decode_track(track: str) -> Dict:
+    """Decodes a track identifier made by `encode_track`."""
+    return json.loads(base64.b64decode(track))
+
+
+class FakePlayer:
+    """A player on the fake Lavalink server.
+
+    Tracks do not produce audio, they only keep time so the right events are sent when they end.
+    """
+
+    def __init__(self, session: 'FakeSession', guild_id: str):
+        self.session = session
+        self.server = session.server
+        self.guild_id = guild_id
+
+        self.track: Optional[str] = None
+        self.end_time = 0
+        self.paused = False
+        self.volume = 100
+        self.connected = False
+
+        self._position = 0
+        self._updated = 0.0
+        self._handle: Optional[asyncio.Handle] = None
+
+    @property
+    def position(self) -> int:
+        """The position of the current track in milliseconds, accelerated by the server's time scale."""
+        if self.track is None:
+            return 0
+        if self.paused:
+            return self._position
+
+        elapsed = (asyncio.get_event_loop().time() - self._updated) * 1000 * self.server.time_scale
+        return int(min(self._position + elapsed, self.end_time))
+
+    def _set_position(self, position: int):
+        self._position = position
+        self._updated = asyncio.get_event_loop().time()
+
+    def _schedule(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self.track is None or self.paused:
+            return
+
+        loop = asyncio.get_event_loop()
+        remaining = max(self.end_time - self.position, 0) / 1000 / self.server.time_scale
+
+        if self.server.random.random() < self.server.stuck_rate:
+            self._handle = loop.call_later(self.server.random.uniform(0, remaining), self._stuck)
+        else:
+            self._handle = loop.call_later(remaining, self.end, 'FINISHED')
+
+    def end(self, reason: str):
+        """Ends the current track, sending a track end event."""
+        track, self.track = self.track, None
+        self._schedule()
+        self.session.send(op='event', type='TrackEndEvent', guildId=self.guild_id, track=track, reason=reason)
+
+    def _stuck(self):
+        self._handle = None
+        self.session.send(op='event', type='TrackStuckEvent', guildId=self.guild_id, track=self.track, thresholdMs=10000)
+
+    def play(self, track: str, *, start: int = 0, end: int = None, no_replace: bool = False):
+        if no_replace and self.track is not None:
+            return
+        if self.track is not None:
+            self.end('REPLACED')
+
+        length = decode_track(track)['length']
+
+        self.track = track
+        self.end_time = min(end or length, length)
+        self._set_position(min(start, self.end_time))
+        self._schedule()
+
+    def stop(self):
+        if self.track is not None:
+            self.end('STOPPED')
+
+    def pause(self, paused: bool):
+        self._set_position(self.position)
+        self.paused = paused
+        self._schedule()
+
+    def seek(self, position: int):
+        if self.track is not None:
+            self._set_position(min(position, self.end_time))
+            self._schedule()
+
+    def destroy(self):
+        self.track = None
+        self._schedule()
+
+    @property
+    def state(self) -> Dict:
+        """The state reported by a `playerUpdate` message."""
+        return {
+            'time': int(time.time() * 1000),
+            'position': self.position,
+            'connected': self.connected
+        }
+
+
+class FakeSession:
+    """A client's session on the fake Lavalink server.
+
+    Messages sent while a resumable session is disconnected are delivered once it is resumed.
+    """
+
+    def __init__(self, server: 'FakeLavalink'):
+        self.server = server
+        self.players: Dict[str, FakePlayer] = dict()
+
+        self.resume_key: Optional[str] = None
+        self.resume_timeout = 60
+
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        self._expiry: Optional[asyncio.Handle] = None
+
+    def send(self, **payload):
+        self._outgoing.put_nowait(payload)
+
+    def _player(self, guild_id: str) -> FakePlayer:
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = FakePlayer(self, guild_id)
+        return player
+
+    async def serve(self, websocket: web.WebSocketResponse):
+        """Handles messages from a connected client until it disconnects."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+        writer = asyncio.ensure_future(self._write(websocket))
+        try:
+            async for message in websocket:
+                if message.type == WSMsgType.TEXT:
+                    self._handle(json.loads(message.data))
+        finally:
+            writer.cancel()
+            self._disconnected()
+
+    async def _write(self, websocket: web.WebSocketResponse):
+        while True:
+            payload = await self._outgoing.get()
+            await websocket.send_json(payload)
+
+    def _handle(self, data: Dict):
+        op = data.get('op')
+        self.server.calls[op] += 1
+
+        if op == 'configureResuming':
+            self.resume_key = data.get('key')
+            self.resume_timeout = data.get('timeout', 60)
+            return
+
+        guild_id = data.get('guildId')
+        if guild_id is None:
+            return
+
+        if op == 'destroy':
+            player = self.players.pop(guild_id, None)
+            if player is not None:
+                player.destroy()
+            return
+
+        player = self._player(guild_id)
+        if op == 'voiceUpdate':
+            player.connected = True
+        elif op == 'play':
+            player.play(
+                data['track'], start=int(data.get('startTime') or 0), end=int(data.get('endTime') or 0) or None,
+                no_replace=data.get('noReplace', False)
+            )
+        elif op == 'stop':
+            player.stop()
+        elif op == 'pause':
+            player.pause(data.get('pause', True))
+        elif op == 'seek':
+            player.seek(int(data['position']))
+        elif op == 'volume':
+            player.volume = data['volume']
+
+    def _disconnected(self):
+        if self.resume_key is None:
+            return self.close()
+
+        self.server._resumable[self.resume_key] = self
+        self._expiry = asyncio.get_event_loop().call_later(self.resume_timeout, self.close)
+
+    def close(self):
+        """Ends the session, destroying its players."""
+        if self.server._resumable.get(self.resume_key) is self:
+            del self.server._resumable[self.resume_key]
+
+        for player in self.players.values():
+            player.destroy()
+        self.players.clear()
+
+        self.server.sessions.discard(self)
+
+
+class FakeLavalink:
+    """A stand-in Lavalink server for running the player without Lavalink or Discord.
+
+    Implements the REST `loadtracks` endpoint and the websocket protocol,
+    sending track end, track stuck, player update and stats messages.
+    Tracks are generated from their identifier, so the same identifier always loads the same track.
+
+    Kwargs:
+        password (str): The password clients must authorize with.
+        latency (float): The mean delay in seconds before `loadtracks` responds.
+        error_rate (float): The fraction of `loadtracks` requests which fail with a server error.
+        stuck_rate (float): The fraction of tracks which get stuck instead of finishing.
+        track_length (tuple of int): The range of generated track lengths in milliseconds.
+        search_results (int): The number of tracks returned by a search.
+        playlist_length (int): The number of tracks in a playlist.
+        time_scale (float): How many times faster than real time tracks play.
+        update_interval (float): How often in seconds player updates are sent.
+        stats_interval (float): How often in seconds stats are sent.
+        seed (int): Seeds the generated tracks, latencies and errors.
+
+    """
+
+    def __init__(self, *, password: str = 'youshallnotpass', latency: float = 0.0, error_rate: float = 0.0, stuck_rate: float = 0.0,
+                 track_length: Tuple[int, int] = (120000, 300000), search_results: int = 5, playlist_length: int = 50,
+                 time_scale: float = 1.0, update_interval: float = 5.0, stats_interval: float = 60.0, seed: int = None):
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stuck_rate = stuck_rate
+        self.track_length = track_length
+        self.search_results = search_results
+        self.playlist_length = playlist_length
+        self.time_scale = time_scale
+        self.update_interval = update_interval
+        self.stats_interval = stats_interval
+        self.seed = seed
+
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.sessions: Set[FakeSession] = set()
+        self._resumable: Dict[str, FakeSession] = dict()
+
+        self._started = time.time()
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks = list()
+
+        self.app = web.Application()
+        self.app.router.add_get('/', self._websocket)
+        self.app.router.add_get('/loadtracks', self._load_tracks)
+
+    @property
+    def players(self):
+        for session in self.sessions:
+            yield from session.players.values()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 2333):
+        """Starts serving on the given address."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+        self._tasks = [asyncio.ensure_future(self._send_player_updates()), asyncio.ensure_future(self._send_stats())]
+
+    async def stop(self):
+        """Stops serving and ends every session."""
+        for task in self._tasks:
+            task.cancel()
+        for session in list(self.sessions):
+            session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _authorized(self, request: web.Request) -> bool:
+        return request.headers.get('Authorization') == self.password
+
+    def _track(self, identifier: str, index: int = 0) -> Dict:
+        """Generates a track, the same identifier and index always generate the same track."""
+        digest = hashlib.sha1(f'{self.seed}:{identifier}:{index}'.encode()).digest()
+        rng = random.Random(digest)
+        video_id = base64.urlsafe_b64encode(digest).decode()[:11]
+
+        info = {
+            'identifier': video_id,
+            'isSeekable': True,
+            'author': f'Artist {rng.randrange(1000)}',
+            'length': rng.randint(*self.track_length),
+            'isStream': False,
+            'position': 0,
+            'title': f'Track {video_id}',
+            'uri': f'https://www.youtube.com/watch?v={video_id}'
+        }
+        return {'track': encode_track(info), 'info': info}
+
+    async def _load_tracks(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.Response(status=401)
+
+        self.calls['loadtracks'] += 1
+        identifier = request.query.get('identifier', '')
+
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(0, 2 * self.latency))
+
+        if self.random.random() < self.error_rate:
+            return web.Response(status=500)
+
+        if identifier.startswith(('ytsearch:', 'scsearch:')):
+            load_type, count, playlist_info = 'SEARCH_RESULT', self.search_results, {}
+        elif 'list=' in identifier or '/sets/' in identifier:
+            load_type, count, playlist_info = 'PLAYLIST_LOADED', self.playlist_length, {'name': f'Playlist {identifier}', 'selectedTrack': -1}
+        else:
+            load_type, count, playlist_info = 'TRACK_LOADED', 1, {}
+
+        return web.json_response({
+            'loadType': load_type,
+            'playlistInfo': playlist_info,
+            'tracks': [self._track(identifier, index) for index in range(count)]
+        })
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        if not self._authorized(request):
+            raise web.HTTPUnauthorized()
+
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        session = self._resumable.pop(request.headers.get('Resume-Key'), None)
+        if session is None:
+            session = FakeSession(self)
+        self.sessions.add(session)
+
+        await session.serve(websocket)
+        return websocket
+
+    async def _send_player_updates(self):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            for player in list(self.players):
+                if player.track is not None and not player.paused:
+                    player.session.send(op='playerUpdate', guildId=player.guild_id, state=player.state)
+
+    async def _send_stats(self):
+        while True:
+            players = list(self.players)
+            for session in self.sessions:
+                session.send(
+                    op='stats',
+                    players=len(players),
+                    playingPlayers=sum(player.track is not None and not player.paused for player in players),
+                    uptime=int((time.time() - self._started) * 1000),
+                    memory={'free': 0, 'used': 0, 'allocated': 0, 'reservable': 0},
+                    cpu={'cores': 1, 'systemLoad': 0.0, 'lavalinkLoad': 0.0},
+                    frameStats={'sent': 3000, 'nulled': 0, 'deficit': 0}
+                )
+            await asyncio.sleep(self.stats_interval)
+
+
+async def _run(server: FakeLavalink, host: str, port: int):
+    await server.start(host, port)
+    print(f'Fake Lavalink server listening on {host}:{port}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a fake Lavalink server for testing the player offline.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2333)
+    parser.add_argument('--password', default='youshallnotpass')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean loadtracks latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of loadtracks requests which fail')
+    parser.add_argument('--stuck-rate', type=float, default=0.0, help='fraction of tracks which get stuck')
+    parser.add_argument('--min-length', type=int, default=120000, help='minimum track length in milliseconds')
+    parser.add_argument('--max-length', type=int, default=300000, help='maximum track length in milliseconds')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='how many times faster than real time tracks play')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeLavalink(
+        password=args.password, latency=args.latency, error_rate=args.error_rate, stuck_rate=args.stuck_rate,
+        track_length=(args.min_length, args.max_length), time_scale=args.time_scale, seed=args.seed
+    )
+
+    try:
+        asyncio.run(_run(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
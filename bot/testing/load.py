@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import tempfile
+import types
+
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+
+import psutil
+
+from discord.ext import commands
+
+import bot.config as config
+from bot.config import config as BOT_CONFIG
+from bot.utils import tools
+
+from .gateway import FakeDiscord, user_payload
+from .lavalink import FakeLavalink
+
+PLAYER_EXTENSION = 'bot.cogs.player'
+
+# Simulated user actions and how often they happen relative to each other
+ACTIONS = {
+    'request': 5,
+    'queue': 2,
+    'playing': 2,
+    'position': 1,
+    'skip': 1,
+    'volume': 1,
+    'churn': 2,
+}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Returns the value below which the given percentage of values fall."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class SimulatedGuild:
+    """A guild of simulated members listening to the bot and using its commands.
+
+    Args:
+        harness (LoadHarness): The harness running the simulation.
+        index (int): The guild's number, used to name it.
+        members (int): The number of members in the guild.
+
+    """
+
+    def __init__(self, harness: 'LoadHarness', index: int, members: int):
+        self.harness = harness
+        self.discord = harness.discord
+        self.random = random.Random(harness.random.random())
+
+        self.users = [user_payload(self.discord.snowflake(), f'user-{index}-{n}') for n in range(members)]
+        data = self.discord.create_guild(f'guild-{index}', self.users)
+
+        self.id = int(data['id'])
+        self.voice_channel = int(next(channel['id'] for channel in data['channels'] if channel['type'] == 2))
+        self.text_channel = int(next(channel['id'] for channel in data['channels'] if channel['type'] == 0))
+        self.listening: Set[str] = set()
+
+    def join(self, user: Dict):
+        self.discord.voice_state_update(self.id, self.voice_channel, user)
+        self.listening.add(user['id'])
+
+    def leave(self, user: Dict):
+        self.discord.voice_state_update(self.id, None, user)
+        self.listening.discard(user['id'])
+
+    def listener(self) -> Dict:
+        """Picks a member who is listening, or anyone if nobody is."""
+        listeners = [user for user in self.users if user['id'] in self.listening]
+        return self.random.choice(listeners or self.users)
+
+    def start(self):
+        """Every member joins the voice channel and one of them requests a track, starting a session."""
+        for user in self.users:
+            self.join(user)
+        self.harness.command(self, self.users[0], f'!p track {self.random.randrange(10 ** 6)}')
+
+    async def run(self, duration: float, interval: float):
+        """Performs random actions for `duration` seconds, waiting `interval` seconds between actions on average."""
+        loop = asyncio.get_event_loop()
+        end = loop.time() + duration
+
+        while True:
+            await asyncio.sleep(self.random.expovariate(1 / interval))
+            if loop.time() >= end:
+                return
+
+            action = self.random.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+            user = self.listener()
+
+            if action == 'request':
+                self.harness.command(self, user, f'!p track {self.random.randrange(10 ** 6)}')
+            elif action == 'queue':
+                self.harness.command(self, user, '!queue')
+            elif action == 'playing':
+                self.harness.command(self, user, '!np')
+            elif action == 'position':
+                self.harness.command(self, user, '!position')
+            elif action == 'skip':
+                self.harness.command(self, user, '!skip')
+            elif action == 'volume':
+                self.harness.command(self, user, f'!volume {self.random.randint(1, 100)}')
+            elif action == 'churn':
+                user = self.random.choice(self.users)
+                if user['id'] in self.listening:
+                    self.leave(user)
+                else:
+                    self.join(user)
+
+
+class Harness:
+    """Runs the player cog in-process against a fake Discord gateway and a fake Lavalink server, measuring how it performs.
+
+    Kwargs:
+        port (int): The port to run the fake Lavalink server on.
+        command_prefix (str): The bot's command prefix.
+        **lavalink: Options for the fake Lavalink server, see `FakeLavalink`.
+
+    """
+
+    def __init__(self, *, port: int = 23330, command_prefix: str = '!', **lavalink):
+        self.port = port
+        self.command_prefix = command_prefix
+        self.lavalink = FakeLavalink(**lavalink)
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Counter = Counter()
+        self.loop_lag: List[float] = list()
+
+        self._sent: Dict[int, float] = dict()
+        self._directory = tempfile.TemporaryDirectory()
+        self._counters: Dict[str, float] = dict()
+        self._lag_task: Optional[asyncio.Future] = None
+
+    def _configure(self):
+        """Points the player at the fake Lavalink server and keeps its files out of the way."""
+        cog_config = BOT_CONFIG.EXTENSIONS[PLAYER_EXTENSION]
+        cog_config.LAVALINK_NODES = [types.SimpleNamespace(
+            host='127.0.0.1', port=self.port, password=self.lavalink.password, identifier='fake', region='us_east'
+        )]
+        cog_config.INSTANCES = []
+        cog_config.TRACE_DIRECTORY = None
+        for key, filename in (('RESOLVE_CACHE_FILE', 'tracks.db'), ('SESSION_SNAPSHOT_FILE', 'sessions.json'), ('LIBRARY_CACHE', 'library.db')):
+            setattr(cog_config, key, os.path.join(self._directory.name, filename))
+
+    def send_command(self, guild_id: int, channel_id: int, user: Dict, content: str):
+        """Sends a command as a user, timing it until it completes."""
+        message = self.discord.message_create(guild_id, channel_id, user, content)
+        self._sent[int(message['id'])] = asyncio.get_event_loop().time()
+
+    async def _finished(self, ctx: commands.Context, error: Exception = None):
+        started = self._sent.pop(ctx.message.id, None)
+        if started is None:
+            return
+
+        name = ctx.command.qualified_name if ctx.command is not None else 'unknown'
+        self.latencies[name].append((asyncio.get_event_loop().time() - started) * 1000)
+        if error is not None:
+            self.failures[f'{name}: {type(error).__name__}'] += 1
+
+    def _message_sent(self, data: Dict):
+        pass
+
+    async def _measure_loop_lag(self, interval: float = 0.1):
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append((loop.time() - started - interval) * 1000)
+
+    @staticmethod
+    def _memory() -> int:
+        gc.collect()
+        return psutil.Process().memory_info().rss
+
+    async def start(self, *, user_id: int = 1) -> commands.Bot:
+        """Starts the fake servers and a bot running the player cog, returning once the player has connected to Lavalink."""
+        self._configure()
+        await self.lavalink.start(port=self.port)
+
+        config._bot = bot = commands.Bot(command_prefix=self.command_prefix, case_insensitive=True, chunk_guilds_at_startup=False)
+        bot.log = logging.getLogger(__name__)
+
+        self.discord = FakeDiscord(bot, user_id=user_id)
+        self.discord.on_message_sent(self._message_sent)
+        self.discord.start()
+
+        bot.add_listener(self._finished, 'on_command_completion')
+        bot.add_listener(self._finished, 'on_command_error')
+        bot.load_extension(PLAYER_EXTENSION)
+
+        while not any(node.is_available for node in bot._wavelink.nodes.values()):
+            await asyncio.sleep(0.1)
+
+        self.bot = bot
+        return bot
+
+    def start_measuring(self):
+        """Starts measuring event loop lag and the rate of calls to Lavalink and Discord."""
+        self._lag_task = asyncio.ensure_future(self._measure_loop_lag())
+        self._counters = {
+            'started': asyncio.get_event_loop().time(),
+            'lavalink_calls': sum(self.lavalink.calls.values()),
+            'lavalink_loads': self.lavalink.calls['loadtracks'],
+            'http_calls': sum(self.discord.http_calls.values()),
+        }
+
+    def stop_measuring(self) -> Dict:
+        """Stops measuring.
+
+        Returns:
+            `dict`: The measurements taken, see `report`.
+
+        """
+        minutes = (asyncio.get_event_loop().time() - self._counters['started']) / 60
+        self._lag_task.cancel()
+
+        return {
+            'sessions': len(self.bot._player_sessions),
+            'latencies': dict(self.latencies),
+            'failures': dict(self.failures),
+            'loop_lag': self.loop_lag,
+            'lavalink_calls_per_minute': (sum(self.lavalink.calls.values()) - self._counters['lavalink_calls']) / minutes,
+            'lavalink_loads_per_minute': (self.lavalink.calls['loadtracks'] - self._counters['lavalink_loads']) / minutes,
+            'http_calls_per_minute': (sum(self.discord.http_calls.values()) - self._counters['http_calls']) / minutes,
+        }
+
+    async def stop(self):
+        """Stops the bot and the fake servers."""
+        self.bot.unload_extension(PLAYER_EXTENSION)
+        await self.lavalink.stop()
+        await self.bot._wavelink.session.close()
+        self._directory.cleanup()
+
+
+class LoadHarness(Harness):
+    """Runs the player cog against simulated Discord guilds and a fake Lavalink server.
+
+    Kwargs:
+        guilds (int): The number of simulated guilds, each runs its own session.
+        members (int): The number of members in each guild.
+        duration (float): How long in seconds to simulate activity for.
+        interval (float): The average number of seconds between actions in each guild.
+        time_scale (float): How many times faster than real time tracks play.
+        lavalink_latency (float): The mean latency in seconds of Lavalink track loads.
+        reaction_delay (float): How long in seconds users take to pick a search result.
+        port (int): The port to run the fake Lavalink server on.
+        seed (int): Seeds the simulation.
+
+    """
+
+    def __init__(self, *, guilds: int = 10, members: int = 5, duration: float = 60, interval: float = 5, time_scale: float = 10,
+                 lavalink_latency: float = 0.05, reaction_delay: float = 0.01, port: int = 23330, seed: int = None):
+        super().__init__(port=port, latency=lavalink_latency, time_scale=time_scale, seed=seed)
+        self.guilds = guilds
+        self.members = members
+        self.duration = duration
+        self.interval = interval
+        self.reaction_delay = reaction_delay
+
+        self.random = random.Random(seed)
+        self._requesters: Dict[int, Dict] = dict()
+
+    def command(self, guild: SimulatedGuild, user: Dict, content: str):
+        """Sends a command as a user of a simulated guild."""
+        self._requesters[guild.text_channel] = user
+        self.send_command(guild.id, guild.text_channel, user, content)
+
+    def _message_sent(self, data: Dict):
+        # Pick the first result whenever the bot asks a user to choose a search result
+        for embed in data['embeds']:
+            if 'search results' in embed.get('author', {}).get('name', ''):
+                channel_id = int(data['channel_id'])
+                asyncio.get_event_loop().call_later(
+                    self.reaction_delay, self.discord.reaction_add,
+                    int(data['guild_id']), channel_id, int(data['id']), self._requesters[channel_id], tools.keycap_digit(1)
+                )
+
+    async def run(self) -> Dict:
+        """Runs the simulation.
+
+        Returns:
+            `dict`: The measurements taken, see `report`.
+
+        """
+        bot = await self.start()
+
+        guilds = [SimulatedGuild(self, index, self.members) for index in range(self.guilds)]
+
+        memory = self._memory()
+        for guild in guilds:
+            guild.start()
+        while len(bot._player_sessions) < len(guilds) and self._sent:
+            await asyncio.sleep(0.1)
+        session_memory = (self._memory() - memory) / max(len(bot._player_sessions), 1)
+
+        self.start_measuring()
+        await asyncio.gather(*(guild.run(self.duration, self.interval) for guild in guilds))
+        results = self.stop_measuring()
+
+        await self.stop()
+
+        results.update(guilds=self.guilds, session_memory=session_memory)
+        return results
+
+
+def report(results: Dict) -> str:
+    """Formats the results of a simulation as a table."""
+    lines = [
+        f'Guilds: {results["guilds"]}, sessions running: {results["sessions"]}',
+        '',
+        f'{"Command latency (ms)":<24}{"count":>8}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}',
+    ]
+
+    for name, latencies in sorted(results['latencies'].items()):
+        lines.append(
+            f'{name:<24}{len(latencies):>8}{percentile(latencies, 50):>10.1f}{percentile(latencies, 90):>10.1f}'
+            f'{percentile(latencies, 99):>10.1f}{max(latencies):>10.1f}'
+        )
+
+    lag = results['loop_lag']
+    lines += [
+        '',
+        f'Event loop lag (ms): p50 {percentile(lag, 50):.1f}, p99 {percentile(lag, 99):.1f}, max {max(lag, default=0):.1f}',
+        f'Memory per session: {results["session_memory"] / 1024:.1f} KiB',
+        f'Lavalink calls per minute: {results["lavalink_calls_per_minute"]:.1f} ({results["lavalink_loads_per_minute"]:.1f} track loads)',
+        f'Discord HTTP requests per minute: {results["http_calls_per_minute"]:.1f}',
+    ]
+
+    if results['failures']:
+        lines += ['', 'Failed commands:']
+        lines += [f'  {name}: {count}' for name, count in sorted(results['failures'].items())]
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how the player cog scales with the number of guilds using it.')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--members', type=int, default=5, help='members per guild')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to simulate activity for')
+    parser.add_argument('--interval', type=float, default=5, help='average seconds between actions in each guild')
+    parser.add_argument('--time-scale', type=float, default=10, help='how many times faster than real time tracks play')
+    parser.add_argument('--lavalink-latency', type=float, default=0.05, help='mean Lavalink track load latency in seconds')
+    parser.add_argument('--port', type=int, default=23330, help='port for the fake Lavalink server')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    harness = LoadHarness(
+        guilds=args.guilds, members=args.members, duration=args.duration, interval=args.interval, time_scale=args.time_scale,
+        lavalink_latency=args.lavalink_latency, port=args.port, seed=args.seed
+    )
+    print(report(asyncio.run(harness.run())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import contextvars
+
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from bot.config import config as BOT_CONFIG
+from bot.cogs.player.trace import TRACE_VERSION, read_trace
+
+from .gateway import user_payload
+from .lavalink import FakePlayer
+from .load import Harness, report
+
+# Tracks only end when the trace says they did
+TRACK_LENGTH = 24 * 60 * 60 * 1000
+
+# Track end reasons caused by Lavalink rather than by the player, the others are reproduced by the fake server
+REPLAYED_END_REASONS = ('FINISHED', 'LOAD_FAILED')
+
+# How long in seconds after the bot replies reactions which were waiting for the reply are added
+REACTION_DELAY = 0.01
+
+# The author of the command being handled, the task handling a command inherits it from the replayer
+command_author: contextvars.ContextVar = contextvars.ContextVar('command_author', default=None)
+
+
+class TraceReplayer(Harness):
+    """Replays a trace recorded by `bot.cogs.player.trace.TraceRecorder` against the player cog.
+
+    Recorded commands, voice state changes and reactions are sent as they were recorded,
+    guilds, channels and users are created the first time the trace refers to them.
+    As the bot's messages are not recorded, reactions are added to the last message the bot sent in the channel in reply to the reacting user,
+    waiting for the bot to reply if it has not since the user's last command.
+    Tracks end when the trace says they did rather than after their length.
+
+    Args:
+        filename (str): The trace to replay.
+
+    Kwargs:
+        speed (float): How many times faster than recorded to replay the trace.
+        lavalink_latency (float): The mean latency in seconds of Lavalink track loads.
+        port (int): The port to run the fake Lavalink server on.
+
+    """
+
+    def __init__(self, filename: str, *, speed: float = 1.0, lavalink_latency: float = 0.05, port: int = 23330):
+        super().__init__(
+            port=port, command_prefix=BOT_CONFIG.PREFIXES, latency=lavalink_latency, track_length=(TRACK_LENGTH, TRACK_LENGTH), time_scale=speed
+        )
+        self.speed = speed
+
+        header, *self.events = read_trace(filename)
+        if header.get('version') != TRACE_VERSION:
+            raise ValueError(f'Unsupported trace version: {header.get("version")}')
+        self.user_id = int(header['user'])
+
+        self.skipped: Counter = Counter()
+        self._guilds: Dict[int, Dict] = dict()
+        self._users: Dict[int, Dict] = dict()
+        self._bot_messages: Dict[Tuple[int, int], int] = dict()
+        self._pending_reactions: Dict[Tuple[int, int], List[Tuple]] = defaultdict(list)
+
+    def _user(self, user_id) -> Dict:
+        user_id = int(user_id)
+        if user_id not in self._users:
+            self._users[user_id] = user_payload(user_id, f'user-{user_id}')
+        return self._users[user_id]
+
+    def _guild(self, guild_id, *, channels: List[Dict] = (), voice_states: List[Dict] = ()) -> int:
+        """Creates a guild the first time it is referred to, returning its ID."""
+        guild_id = int(guild_id)
+        if guild_id not in self._guilds:
+            users = [self._user(state['user_id']) for state in voice_states]
+            self._guilds[guild_id] = self.discord.guild_create(
+                guild_id, f'guild-{guild_id}', users,
+                [self.discord.channel_payload(int(channel['id']), channel['type'] == 2, index) for index, channel in enumerate(channels)],
+                voice_states=[
+                    self.discord.voice_state_payload(guild_id, state['channel_id'], user, deaf=state['self_deaf'])
+                    for state, user in zip(voice_states, users)
+                ]
+            )
+        return guild_id
+
+    def _channel(self, guild_id: int, channel_id, voice: bool) -> Optional[int]:
+        """Creates a channel the first time it is referred to, returning its ID."""
+        if channel_id is None:
+            return None
+
+        channel_id = int(channel_id)
+        if self.bot.get_channel(channel_id) is None:
+            self.discord.channel_create(guild_id, channel_id, voice)
+        return channel_id
+
+    def _gateway(self, name: str, data: Dict):
+        if name == 'GUILD_CREATE':
+            self._guild(data['id'], channels=data['channels'], voice_states=data['voice_states'])
+
+        elif name == 'VOICE_STATE_UPDATE':
+            guild_id = self._guild(data['guild_id'])
+            channel_id = self._channel(guild_id, data['channel_id'], True)
+            self.discord.voice_state_update(guild_id, channel_id, self._user(data['user_id']), deaf=data['self_deaf'])
+
+        elif name == 'MESSAGE_CREATE':
+            guild_id = self._guild(data['guild_id'])
+            channel_id = self._channel(guild_id, data['channel_id'], False)
+            user = self._user(data['author_id'])
+            self._bot_messages.pop((channel_id, int(user['id'])), None)
+
+            token = command_author.set(int(user['id']))
+            self.send_command(guild_id, channel_id, user, data['content'])
+            command_author.reset(token)
+
+        elif name == 'MESSAGE_REACTION_ADD':
+            guild_id = self._guild(data['guild_id'])
+            channel_id = self._channel(guild_id, data['channel_id'], False)
+            user = self._user(data['user_id'])
+            key = (channel_id, int(user['id']))
+            if key in self._bot_messages:
+                self.discord.reaction_add(guild_id, channel_id, self._bot_messages[key], user, data['emoji'])
+            else:
+                self._pending_reactions[key].append((guild_id, channel_id, user, data['emoji']))
+
+    def _player(self, guild_id: str) -> Optional[FakePlayer]:
+        return next((player for player in self.lavalink.players if player.guild_id == guild_id), None)
+
+    def _lavalink(self, name: str, data: Dict):
+        player = self._player(data['guildId'])
+        if player is None or player.track is None:
+            self.skipped[name] += 1
+            return
+
+        if name == 'TrackEndEvent':
+            if data.get('reason') in REPLAYED_END_REASONS:
+                player.end(data['reason'])
+        elif name != 'TrackStartEvent':
+            player.session.send(**dict(data, op='event', track=player.track))
+
+    def _message_sent(self, data: Dict):
+        author = command_author.get()
+        if author is None:
+            return
+
+        key = (int(data['channel_id']), author)
+        self._bot_messages[key] = int(data['id'])
+        for guild_id, channel_id, user, emoji in self._pending_reactions.pop(key, ()):
+            asyncio.get_event_loop().call_later(REACTION_DELAY, self.discord.reaction_add, guild_id, channel_id, self._bot_messages[key], user, emoji)
+
+    async def run(self, *, timeout: float = 30) -> Dict:
+        """Replays the trace, then waits up to `timeout` seconds for the remaining commands to complete.
+
+        Returns:
+            `dict`: The measurements taken, see `bot.testing.load.report`.
+
+        """
+        bot = await self.start(user_id=self.user_id)
+
+        memory = self._memory()
+        self.start_measuring()
+
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        for elapsed, source, name, data in self.events:
+            delay = started + elapsed / 1000 / self.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if source == 'g':
+                self._gateway(name, data)
+            else:
+                self._lavalink(name, data)
+
+        end = loop.time() + timeout
+        while self._sent and loop.time() < end:
+            await asyncio.sleep(0.1)
+
+        pending = sum(len(reactions) for reactions in self._pending_reactions.values())
+        if pending:
+            self.skipped['MESSAGE_REACTION_ADD'] += pending
+        results = self.stop_measuring()
+        session_memory = (self._memory() - memory) / max(len(bot._player_sessions), 1)
+        await self.stop()
+
+        results.update(guilds=len(self._guilds), session_memory=session_memory, skipped=dict(self.skipped))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays a trace recorded by the player cog against fake Discord and Lavalink servers.')
+    parser.add_argument('trace', help='the trace file to replay')
+    parser.add_argument('--speed', type=float, default=1, help='how many times faster than recorded to replay the trace')
+    parser.add_argument('--lavalink-latency', type=float, default=0.05, help='mean Lavalink track load latency in seconds')
+    parser.add_argument('--port', type=int, default=23330, help='port for the fake Lavalink server')
+    args = parser.parse_args()
+
+    results = asyncio.run(TraceReplayer(args.trace, speed=args.speed, lavalink_latency=args.lavalink_latency, port=args.port).run())
+    print(report(results))
+    if results['skipped']:
+        print('\nSkipped events:')
+        print('\n'.join(f'  {name}: {count}' for name, count in sorted(results['skipped'].items())))
+
+
+if __name__ == '__main__':
+    main()